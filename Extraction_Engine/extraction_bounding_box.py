@@ -5,8 +5,16 @@ from google import genai
 from google.genai import types
 import streamlit as st
 
+from Secure_shield.page_cache import page_fingerprint, keyword_hits
+from resilience import CallGuard
+from concurrency import PDF_LOCK
+
 MODEL_NAME = "gemini-2.5-flash"
 
+# Deadline + retries + breaker for every Gemini call (no hedging and no retry after a
+# deadline overrun: the abandoned call is still running, duplicate LLM calls cost tokens)
+gemini_guard = CallGuard("gemini", deadline_s=90, max_retries=2, backoff_base_s=1.0, retry_deadlines=False)
+
 client = genai.Client(
     api_key=st.secrets["GEMINI_API_KEY"]
 )
@@ -14,26 +22,53 @@ response = client.models.list()
 for m in response:
     print(m.name, m.description)
 class LegalBrain:
-    def __init__(self):
+    def __init__(self, page_cache=None):
         self.model = MODEL_NAME
+        # Optional PageFingerprintCache: boilerplate pages already judged
+        # "no KPI content" are skipped without a keyword scan. Used only when
+        # the caller has no per-page verdict from the shield (see run(pages=...))
+        self.page_cache = page_cache
+
+    def has_kpi_content(self, text):
+        if self.page_cache is None:
+            return bool(keyword_hits(text))
+        fingerprint = page_fingerprint(text)
+        no_kpi = self.page_cache.get(fingerprint, "no_kpi", stage="extraction")
+        if no_kpi is None:
+            hits = keyword_hits(text)
+            no_kpi = not hits
+            self.page_cache.put(fingerprint, keyword_hits=hits, no_kpi=no_kpi)
+        return not no_kpi
 
-    def extract_text_blocks(self, pdf_path):
-        doc = fitz.open(pdf_path)
+    def extract_text_blocks(self, pdf_path, pages=None):
+        """Text blocks of the pages that carry KPI content.
+
+        `pages` (0-based) are pages already known to hold KPI content, e.g. from
+        the shield's per-page verdict; without them every page is scanned.
+        """
+        with PDF_LOCK:
+            doc = fitz.open(pdf_path)
+            page_count = len(doc)
         blocks = []
         # We need to search the WHOLE doc because your data is on pages 18 and 149
-        for page_idx in range(len(doc)):
-            page = doc[page_idx]
-            text = page.get_text("text").lower()
-            # Only send pages that actually have our data to save tokens/improve accuracy
-            if any(kw in text for kw in ["project site", "ndvi", "bps", "latitude"]):
-                for block in page.get_text("blocks"):
-                    x0, y0, x1, y1, text, *_ = block
-                    if text.strip():
-                        blocks.append({
-                            "p": page_idx + 1,
-                            "t": text.strip(),
-                            "b": [y0, x0, y1, x1] # Raw coordinates
-                        })
+        for page_idx in (range(page_count) if pages is None else pages):
+            if page_idx >= page_count:
+                continue
+            with PDF_LOCK:
+                page = doc[page_idx]
+                # Only send pages that actually have our data to save tokens/improve accuracy
+                page_blocks = (page.get_text("blocks")
+                               if pages is not None or self.has_kpi_content(page.get_text("text")) else [])
+            for block in page_blocks:
+                x0, y0, x1, y1, text, *_ = block
+                if text.strip():
+                    blocks.append({
+                        "p": page_idx + 1,
+                        "t": text.strip(),
+                        "b": [y0, x0, y1, x1] # Raw coordinates
+                    })
+        with PDF_LOCK:
+            doc.close()
         return blocks
 
     def extract_fields_with_gemini(self, blocks):
@@ -58,7 +93,8 @@ class LegalBrain:
         STRICT: Do not invent data. Use ONLY the provided text blocks.
         """
 
-        response = client.models.generate_content(
+        response = gemini_guard.call(
+            client.models.generate_content,
             model=self.model,
             contents=[prompt, f"DOC_BLOCKS: {json.dumps(blocks)}"],
             config=types.GenerateContentConfig(
@@ -68,7 +104,7 @@ class LegalBrain:
         )
         return json.loads(response.text)
 
-    def run(self, pdf_path):
-        blocks = self.extract_text_blocks(pdf_path)
+    def run(self, pdf_path, pages=None):
+        blocks = self.extract_text_blocks(pdf_path, pages=pages)
         return self.extract_fields_with_gemini(blocks)
 
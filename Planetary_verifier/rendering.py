@@ -0,0 +1,129 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+
+def _palette_lut(colors, steps=256):
+    """Linear colour ramp through `colors` as a (steps, 3) uint8 lookup table."""
+    colors = np.asarray(colors, dtype=np.float32)
+    positions = np.linspace(0, 1, len(colors))
+    x = np.linspace(0, 1, steps)
+    return np.stack([np.interp(x, positions, colors[:, c]) for c in range(3)], axis=1).astype(np.uint8)
+
+
+# Same ramp the Earth Engine thumbnails used: palette ['red', 'yellow', 'green']
+NDVI_LUT = _palette_lut([(255, 0, 0), (255, 255, 0), (0, 128, 0)])
+
+
+def _upscale(pixels, dimensions):
+    """Nearest-neighbour upscale so the longest side is about `dimensions` px."""
+    factor = max(1, dimensions // max(pixels.shape[:2]))
+    return np.repeat(np.repeat(pixels, factor, axis=0), factor, axis=1)
+
+
+def render_ndvi_heatmap(grid, vmin=0.0, vmax=1.0, dimensions=512):
+    """Red-yellow-green NDVI heatmap as RGBA; pixels outside the ROI are transparent."""
+    valid = ~np.isnan(grid)
+    scaled = (np.nan_to_num(grid, nan=vmin) - vmin) / (vmax - vmin)
+    idx = np.clip((scaled * (len(NDVI_LUT) - 1)).round(), 0, len(NDVI_LUT) - 1).astype(np.uint8)
+    rgba = np.empty(grid.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = NDVI_LUT[idx]
+    rgba[..., 3] = np.where(valid, 255, 0)
+    return _upscale(rgba, dimensions)
+
+
+def render_breach_mask(grid, threshold=0.2, dimensions=512):
+    """Black/white breach mask (white = NDVI below threshold) as RGBA."""
+    valid = ~np.isnan(grid)
+    breach = valid & (np.nan_to_num(grid, nan=1.0) < threshold)
+    rgba = np.zeros(grid.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = np.where(breach, 255, 0)[..., None]
+    rgba[..., 3] = np.where(valid, 255, 0)
+    return _upscale(rgba, dimensions)
+
+
+def render_breach_fraction(fraction, dimensions=512):
+    """Greyscale breach share per cell (white = fully degraded), for coarser pyramid levels."""
+    valid = ~np.isnan(fraction)
+    level = np.clip(np.nan_to_num(fraction) * 255, 0, 255).astype(np.uint8)
+    rgba = np.zeros(fraction.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = level[..., None]
+    rgba[..., 3] = np.where(valid, 255, 0)
+    return _upscale(rgba, dimensions)
+
+
+RENDERERS = {
+    "ndvi_heatmap": render_ndvi_heatmap,
+    "breach_mask": render_breach_mask,
+    "breach_fraction": render_breach_fraction,
+}
+
+
+class ImageCache:
+    """
+    Content-addressed PNG cache for rendered NDVI grids.
+
+    The file name is a hash of the grid bytes and the render parameters, so
+    the same audit always maps to the same file: re-displaying it (or every
+    Streamlit rerun) reads a local PNG instead of calling Earth Engine.
+    """
+
+    def __init__(self, cache_dir="static/img_cache"):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.renders = 0
+
+    def key(self, kind, grid, **params):
+        digest = hashlib.sha256()
+        digest.update(kind.encode())
+        digest.update(repr(sorted(params.items())).encode())
+        digest.update(repr(grid.shape).encode())
+        digest.update(np.ascontiguousarray(grid, dtype=np.float32).tobytes())
+        return digest.hexdigest()[:32]
+
+    def get_or_render(self, kind, grid, **params):
+        path = os.path.join(self.cache_dir, f"{kind}_{self.key(kind, grid, **params)}.png")
+        if os.path.exists(path):
+            self.hits += 1
+            return path
+
+        pixels = RENDERERS[kind](grid, **params)
+        # Write to a unique temp file then rename, so a concurrent reader never
+        # sees a half-written PNG and concurrent renders never share a temp file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                Image.fromarray(pixels).save(f, format="PNG")
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            # Lost the rename to a concurrent render of the same key: same bytes
+            if not os.path.exists(path):
+                raise
+            self.hits += 1
+            return path
+        self.renders += 1
+        return path
+
+
+# --- TEST BLOCK ---
+if __name__ == "__main__":
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache_dir = tempfile.mkdtemp()
+    cache = ImageCache(cache_dir)
+    grid = np.random.default_rng(0).uniform(-0.2, 0.9, (64, 64))
+
+    # Many threads rendering the same image at once all get the cached PNG
+    with ThreadPoolExecutor(16) as pool:
+        paths = list(pool.map(lambda _: cache.get_or_render("ndvi_heatmap", grid), range(160)))
+    assert len(set(paths)) == 1 and os.path.exists(paths[0])
+    assert os.listdir(cache_dir) == [os.path.basename(paths[0])], os.listdir(cache_dir)
+    print(f"160 concurrent renders -> 1 PNG ({cache.renders} renders, {cache.hits} hits)")
+    shutil.rmtree(cache_dir)
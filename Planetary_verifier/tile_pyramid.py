@@ -0,0 +1,248 @@
+import math
+import os
+import tempfile
+
+import numpy as np
+
+from Planetary_verifier.site_index import METERS_PER_DEG_LAT
+
+# Pyramid levels, keyed by the nominal (N-S) metres per pixel of the EPSG:4326
+# grid; the base level is the 10 m Sentinel-2 grid. E-W cells are scale*cos(lat).
+LEVEL_SCALES_M = (10, 20, 40, 80)
+
+
+def _downsample(grid, factor, threshold):
+    """NaN-aware block reduction: (mean NDVI, valid pixel count, breach pixel count)."""
+    height, width = grid.shape
+    ph, pw = -(-height // factor) * factor, -(-width // factor) * factor
+    padded = np.full((ph, pw), np.nan, dtype=np.float32)
+    padded[:height, :width] = grid
+    blocks = padded.reshape(ph // factor, factor, pw // factor, factor)
+
+    valid = ~np.isnan(blocks)
+    count = valid.sum(axis=(1, 3)).astype(np.uint16)
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3), dtype=np.float64)
+    breach = (valid & (np.nan_to_num(blocks, nan=1.0) < threshold)).sum(axis=(1, 3)).astype(np.uint16)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, total / count, np.nan).astype(np.float32)
+    return mean, count, breach
+
+
+def polygon_bounds(polygon):
+    """(min_lon, min_lat, max_lon, max_lat) box around a list of (lon, lat) vertices."""
+    pts = np.asarray(polygon, dtype=np.float64)
+    return (pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max())
+
+
+def polygon_mask(polygon, bounds, shape):
+    """Pixel-centre even-odd test of a (lon, lat) polygon over a grid covering `bounds`."""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    height, width = shape
+    lons = min_lon + (np.arange(width) + 0.5) * (max_lon - min_lon) / width
+    lats = max_lat - (np.arange(height) + 0.5) * (max_lat - min_lat) / height
+    x, y = np.meshgrid(lons, lats)
+
+    inside = np.zeros(shape, dtype=bool)
+    pts = np.asarray(polygon, dtype=np.float64)
+    for (xi, yi), (xj, yj) in zip(pts, np.roll(pts, -1, axis=0)):
+        if yi == yj:
+            continue
+        crosses = (yi > y) != (yj > y)
+        inside ^= crosses & (x < (xj - xi) * (y - yi) / (yj - yi) + xi)
+    return inside
+
+
+def crop_to_bounds(grid, grid_bounds, bounds):
+    """Sub-grid covering `bounds` out of a grid covering `grid_bounds` (both lon/lat boxes)."""
+    height, width = grid.shape
+    min_lon, min_lat, max_lon, max_lat = grid_bounds
+    deg_x, deg_y = (max_lon - min_lon) / width, (max_lat - min_lat) / height
+    c0 = int(np.clip(round((bounds[0] - min_lon) / deg_x), 0, width))
+    c1 = int(np.clip(round((bounds[2] - min_lon) / deg_x), 0, width))
+    r0 = int(np.clip(round((max_lat - bounds[3]) / deg_y), 0, height))
+    r1 = int(np.clip(round((max_lat - bounds[1]) / deg_y), 0, height))
+    return grid[r0:max(r1, r0 + 1), c0:max(c1, c0 + 1)]
+
+
+class NDVIPyramid:
+    """
+    Multi-resolution NDVI median + breach pyramid for one site and observation window.
+
+    Built once from the 10 m grid the verifier already fetches. Each level keeps
+    the mean NDVI, the count of valid 10 m pixels and the count of breach pixels
+    per cell, so zonal statistics at any level stay exact area-weighted
+    aggregates of the base grid. Stored as one compressed .npz per site.
+    """
+
+    def __init__(self, bounds, levels, threshold=0.2, window=None):
+        self.bounds = tuple(float(b) for b in bounds)  # (min_lon, min_lat, max_lon, max_lat)
+        self.levels = levels                           # scale_m -> (ndvi, valid, breach)
+        self.threshold = threshold
+        self.window = window                           # (start_date, end_date)
+
+    @classmethod
+    def build(cls, grid, bounds, threshold=0.2, scales=LEVEL_SCALES_M, window=None):
+        base = scales[0]
+        levels = {}
+        for scale in scales:
+            levels[scale] = _downsample(np.asarray(grid, dtype=np.float32), scale // base, threshold)
+        return cls(bounds, levels, threshold, window)
+
+    # --- STORAGE ---
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {
+            "bounds": np.array(self.bounds),
+            "threshold": np.array(self.threshold),
+            "window": np.array(self.window or ("", "")),
+        }
+        for scale, (ndvi, valid, breach) in self.levels.items():
+            arrays[f"ndvi_{scale}"] = ndvi
+            arrays[f"valid_{scale}"] = valid
+            arrays[f"breach_{scale}"] = breach
+        # Unique temp file per writer, then rename: concurrent saves of the same
+        # site never share a temp file and readers never see a partial archive
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp.npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            # Lost the rename to a concurrent save of the same site and window
+            if not os.path.exists(path):
+                raise
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            scales = sorted(int(k.split("_")[1]) for k in data.files if k.startswith("ndvi_"))
+            levels = {s: (data[f"ndvi_{s}"], data[f"valid_{s}"], data[f"breach_{s}"]) for s in scales}
+            window = tuple(str(w) for w in data["window"]) if "window" in data.files else None
+            return cls(tuple(data["bounds"]), levels, float(data["threshold"]), window)
+
+    # --- SERVING ---
+    def level_for(self, scale_m):
+        """Nearest stored level (in log scale) to the requested ground metres per pixel."""
+        return min(self.levels, key=lambda s: abs(np.log2(math.sqrt(math.prod(self.pixel_m(s))) / float(scale_m))))
+
+    def pixel_m(self, scale):
+        """Ground size of a level's cells in metres: (N-S, E-W)."""
+        deg_x, deg_y = self._cell_deg(scale)
+        mid_lat = (self.bounds[1] + self.bounds[3]) / 2
+        return deg_y * METERS_PER_DEG_LAT, deg_x * METERS_PER_DEG_LAT * math.cos(math.radians(mid_lat))
+
+    def _cell_deg(self, scale):
+        """Cell size of a level in degrees (coarse levels are padded past the site edge)."""
+        base_scale = min(self.levels)
+        base_h, base_w = self.levels[base_scale][0].shape
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        factor = scale // base_scale
+        return (max_lon - min_lon) / base_w * factor, (max_lat - min_lat) / base_h * factor
+
+    def _window(self, scale, bounds):
+        """Row/column slices of a level covering `bounds` (clamped to the site)."""
+        height, width = self.levels[scale][0].shape
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        deg_x, deg_y = self._cell_deg(scale)
+        if bounds is None:
+            return slice(0, height), slice(0, width)
+        c0 = int(np.clip(np.floor((bounds[0] - min_lon) / deg_x), 0, width))
+        c1 = int(np.clip(np.ceil((bounds[2] - min_lon) / deg_x), 0, width))
+        r0 = int(np.clip(np.floor((max_lat - bounds[3]) / deg_y), 0, height))
+        r1 = int(np.clip(np.ceil((max_lat - bounds[1]) / deg_y), 0, height))
+        return slice(r0, max(r1, r0 + 1)), slice(c0, max(c1, c0 + 1))
+
+    def _window_bounds(self, scale, rows, cols):
+        min_lon, _, _, max_lat = self.bounds
+        deg_x, deg_y = self._cell_deg(scale)
+        return (min_lon + cols.start * deg_x, max_lat - rows.stop * deg_y,
+                min_lon + cols.stop * deg_x, max_lat - rows.start * deg_y)
+
+    def zonal_stats(self, polygon=None, bounds=None, scale_m=10):
+        """Mean NDVI and breach ratio over a sub-polygon/box, from the nearest level."""
+        scale = self.level_for(scale_m)
+        if polygon is not None and bounds is None:
+            bounds = polygon_bounds(polygon)
+        rows, cols = self._window(scale, bounds)
+        ndvi, valid, breach = (a[rows, cols] for a in self.levels[scale])
+
+        weights = valid.astype(np.float64)
+        if polygon is not None:
+            weights = weights * polygon_mask(polygon, self._window_bounds(scale, rows, cols), ndvi.shape)
+        n_valid = weights.sum()
+        if n_valid == 0:
+            return {"status": "ERROR", "reason": "No valid pixels in the requested area.", "scale_m": scale}
+
+        cell_breach = np.where(valid > 0, breach / np.maximum(valid, 1), 0.0)
+        return {
+            "status": "SUCCESS",
+            "scale_m": scale,
+            "pixel_m": [round(v, 1) for v in self.pixel_m(scale)],
+            "mean_ndvi": round(float(np.nansum(np.nan_to_num(ndvi) * weights) / n_valid), 4),
+            "breach_ratio": round(float((cell_breach * weights).sum() / n_valid), 4),
+            "valid_pixels_10m": int(n_valid),
+            "cells": int(np.count_nonzero(weights)),
+        }
+
+    def imagery(self, image_cache, bounds=None, scale_m=10):
+        """Heatmap and breach-fraction images for a zoom window, rendered from the nearest level."""
+        scale = self.level_for(scale_m)
+        rows, cols = self._window(scale, bounds)
+        ndvi, valid, breach = (a[rows, cols] for a in self.levels[scale])
+        fraction = np.where(valid > 0, breach / np.maximum(valid, 1), np.nan).astype(np.float32)
+        return {
+            "scale_m": scale,
+            "pixel_m": [round(v, 1) for v in self.pixel_m(scale)],
+            "map_thumb_url": image_cache.get_or_render("ndvi_heatmap", ndvi, vmin=0.0, vmax=1.0),
+            "mask_thumb_url": image_cache.get_or_render("breach_fraction", fraction),
+        }
+
+
+# --- TEST BLOCK ---
+if __name__ == "__main__":
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    rng = np.random.default_rng(11)
+    grid = rng.random((100, 100)).astype(np.float32)
+    grid[:10, :] = np.nan  # outside the clipped ROI
+    bounds = (24.318, 61.620, 24.337, 61.629)
+
+    t0 = time.perf_counter()
+    pyramid = NDVIPyramid.build(grid, bounds, window=("2025-09-01", "2026-01-01"))
+    path = pyramid.save(os.path.join(tempfile.mkdtemp(), "site.npz"))
+    pyramid = NDVIPyramid.load(path)
+    print(f"Built + saved {sorted(pyramid.levels)} m levels in {time.perf_counter() - t0:.3f}s "
+          f"({os.path.getsize(path) / 1024:.0f} KiB)")
+
+    # Portfolio workers re-saving the same site at once all succeed
+    with ThreadPoolExecutor(16) as pool:
+        assert set(pool.map(lambda _: pyramid.save(path), range(80))) == {path}
+    assert os.listdir(os.path.dirname(path)) == ["site.npz"]
+
+    # EPSG:4326 cells: 10 m N-S, and the E-W degree span shrunk by cos(lat) back to ~10 m
+    assert all(abs(v - 10) < 0.5 for v in pyramid.pixel_m(10)), pyramid.pixel_m(10)
+
+    # Whole-site statistics agree at every level (area-weighted, so exact)
+    truth_mean = float(np.nanmean(grid))
+    truth_breach = float(np.nansum(grid < 0.2) / np.count_nonzero(~np.isnan(grid)))
+    for scale in LEVEL_SCALES_M:
+        stats = pyramid.zonal_stats(scale_m=scale)
+        assert abs(stats["mean_ndvi"] - truth_mean) < 1e-3, (scale, stats)
+        assert abs(stats["breach_ratio"] - truth_breach) < 1e-3, (scale, stats)
+
+    # A sub-polygon served from the 40 m level without touching the base grid
+    tri = [(24.320, 61.621), (24.335, 61.621), (24.3275, 61.628)]
+    print(pyramid.zonal_stats(polygon=tri, scale_m=35))
+
+    # Imagery for that polygon's box is a crop, not the whole site
+    from Planetary_verifier.rendering import ImageCache
+    from PIL import Image
+    cache = ImageCache(tempfile.mkdtemp())
+    site = Image.open(pyramid.imagery(cache, scale_m=10)["map_thumb_url"]).size
+    crop = Image.open(pyramid.imagery(cache, bounds=polygon_bounds(tri), scale_m=10)["map_thumb_url"]).size
+    assert crop[0] < site[0] and crop[1] < site[1], (crop, site)
+    print("All pyramid checks passed.")
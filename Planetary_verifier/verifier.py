@@ -1,8 +1,18 @@
 import ee
+import math
+import numpy as np
 import os
 import json
 import streamlit as st
 
+from resilience import CallGuard, CircuitOpenError, DeadlineExceeded
+from concurrent.futures import ThreadPoolExecutor
+
+from Planetary_verifier.site_index import SiteGroup, SiteIndex, site_bounds, METERS_PER_DEG_LAT
+from Planetary_verifier.tile_pyramid import NDVIPyramid, crop_to_bounds, polygon_bounds
+from Planetary_verifier.patch_analysis import analyze_patches
+from Planetary_verifier.rendering import ImageCache
+
 # Initialize Earth Engine
 # --- NEW SECURE INITIALIZATION ---
 def initialize_ee():
@@ -52,9 +62,151 @@ initialize_ee()
 
 
 #ee.Initialize(project='semiotic-art-483903-r6')
+# sampleRectangle refuses requests above this many pixels
+MAX_SAMPLE_PX = 262_144
+
+# Every getInfo() round-trip goes through here: deadline, jittered retries,
+# a hedged duplicate once a call runs past the observed p95, and a breaker
+earth_engine_guard = CallGuard("earth_engine", deadline_s=60, max_retries=3,
+                               hedge_after_s="p95", failure_threshold=5, reset_after_s=60)
+
 class PlanetaryVerifier:
-    def __init__(self):
+    def __init__(self, guard=None, min_patch_m2=2_500, image_cache=None, pyramid_dir="static/pyramids"):
         self.collection_id = "COPERNICUS/S2_SR_HARMONIZED"
+        # Observation window for the median stack (also keys the per-site tile pyramids)
+        self.start_date = '2025-09-01'
+        self.end_date = '2026-01-01'
+        self.pyramid_dir = pyramid_dir
+        self.guard = guard or earth_engine_guard
+        self.image_cache = image_cache or ImageCache()
+        # Breach patches smaller than this (0.25 ha) are treated as noise
+        self.min_patch_m2 = min_patch_m2
+
+    def _info(self, ee_object):
+        return self.guard.call(ee_object.getInfo)
+
+    def _median_stack(self, roi):
+        """Cloud-filtered Sentinel-2 NDVI median over an ROI: (median_image, image_count)."""
+        # TEMPORAL MEDIAN STACKING (30-Day Window)
+        # We look back 30 days from today to stack images and remove clouds
+        s2_data = (ee.ImageCollection(self.collection_id)
+                   .filterBounds(roi)
+                   .filterDate(self.start_date, self.end_date)
+                   .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20)))
+
+        image_count = self._info(s2_data.size())
+        if image_count == 0:
+            return None, 0
+
+        # NDVI CALCULATION & MEDIAN REDUCTION
+        def add_ndvi(img):
+            return img.addBands(img.normalizedDifference(['B8', 'B4']).rename('NDVI'))
+
+        # The .median() part handles the "Stacking" to find the statistical truth
+        return s2_data.map(add_ndvi).select('NDVI').median(), image_count
+
+    def _fetch_ndvi_grid(self, median_image, roi, scale=10):
+        """Pulls the clipped NDVI median down as a 2-D numpy array (NaN outside the ROI)."""
+        no_data = -9999
+        sample = (median_image.reproject(crs='EPSG:4326', scale=scale)
+                  .sampleRectangle(region=roi, defaultValue=no_data))
+        grid = np.array(self._info(sample.get('NDVI')), dtype=np.float32)
+        grid[grid == no_data] = np.nan
+        return grid
+
+    @staticmethod
+    def _grid_pixels(bounds, scale=10):
+        """Pixel count of _fetch_ndvi_grid over a lon/lat box (EPSG:4326, scale in metres at the equator)."""
+        px_deg = scale / METERS_PER_DEG_LAT
+        return int((bounds[2] - bounds[0]) / px_deg + 1) * int((bounds[3] - bounds[1]) / px_deg + 1)
+
+    @staticmethod
+    def _pixel_area_m2(lat, scale=10):
+        """Ground area of one _fetch_ndvi_grid pixel: EPSG:4326 pixels are scale m N-S, scale*cos(lat) m E-W."""
+        return scale * scale * math.cos(math.radians(lat))
+
+    def _patch_stats(self, grid, degradation_threshold, lat):
+        valid = ~np.isnan(grid)
+        breach_mask = valid & (np.nan_to_num(grid, nan=1.0) < degradation_threshold)
+        pixel_area_m2 = self._pixel_area_m2(lat)
+        # The noise floor is an area, so it means the same patch size at every latitude
+        min_patch_px = max(1, math.ceil(self.min_patch_m2 / pixel_area_m2))
+        return analyze_patches(breach_mask, valid=valid, pixel_area_m2=pixel_area_m2,
+                               min_patch_px=min_patch_px)
+
+    def pyramid_path(self, lat, lon):
+        return os.path.join(self.pyramid_dir,
+                            f"{float(lat):.5f}_{float(lon):.5f}_{self.start_date}_{self.end_date}.npz")
+
+    def _local_verdict(self, grid, target_ndvi, image_count, site, degradation_threshold=0.2):
+        """Zonal mean, breach ratio and verdict for one site, from its NDVI grid (NaN outside the ROI).
+
+        Every verification path comes through here, so a site gets the same
+        verdict alone or as part of a portfolio.
+        """
+        # 5. ZONAL MEAN (Polygon Statistics): all valid pixels inside the ROI
+        valid = ~np.isnan(grid)
+        if not valid.any():
+            return {"status": "ERROR", "reason": "No valid pixels inside the site polygon."}
+        actual_score = float(grid[valid].mean())
+        # 6. BREACH RATIO: share of pixels below the critical degradation threshold
+        # (0.2 is standard for soil/rock/snow)
+        breach_ratio = float((grid[valid] < degradation_threshold).mean())
+        return self._verdict(actual_score, breach_ratio, target_ndvi, image_count, grid, site,
+                             degradation_threshold=degradation_threshold)
+
+    def _verdict(self, actual_score, breach_ratio, target_ndvi, image_count, grid, site,
+                 degradation_threshold=0.2):
+        breach_percentage = round(breach_ratio * 100, 2)
+
+        # 8. PATCH ANALYSIS: one large clear-cut vs scattered noisy pixels
+        patches = self._patch_stats(grid, degradation_threshold, site[0])
+
+        # 8b. TILE PYRAMID: 10/20/40/80 m levels for later drill-down without a new stack
+        pyramid_path = None
+        if site is not None:
+            lat_f, lon_f = site
+            try:
+                pyramid_path = NDVIPyramid.build(
+                    grid, site_bounds(lat_f, lon_f), threshold=degradation_threshold,
+                    window=(self.start_date, self.end_date)
+                ).save(self.pyramid_path(lat_f, lon_f))
+            except Exception as e:
+                # Drill-down rebuilds a missing pyramid; the verdict stands without it
+                print(f"⚠️ Tile pyramid not saved: {e}")
+
+        # 9. IMAGERY: rendered locally into the content-addressed cache
+        map_thumb = self.image_cache.get_or_render("ndvi_heatmap", grid, vmin=0.0, vmax=1.0)
+        mask_thumb = self.image_cache.get_or_render("breach_mask", grid, threshold=degradation_threshold)
+
+        # 6. FINAL VERDICT
+        is_breach = actual_score < float(target_ndvi)
+
+        res = {
+            "status": "SUCCESS",
+            "image_count":image_count,
+            "actual_ndvi": round(actual_score, 4),
+            "target_ndvi": float(target_ndvi),
+            "breach_area_percentage": f"{breach_percentage}%",
+            "is_breach": is_breach,
+            "verdict": "BREACH: ADJUST MARGIN UP" if is_breach else "COMPLIANT: APPLY DISCOUNT",
+            "map_thumb_url": map_thumb,
+            "mask_thumb_url": mask_thumb,
+            "analysis": f"Critical degradation detected in {breach_percentage}% of the site polygon."
+        }
+        if patches:
+            res.update({
+                "patch_count": patches["patch_count"],
+                "largest_patch_area_m2": patches["largest_patch_area_m2"],
+                "patch_size_histogram": patches["size_histogram"],
+                "significant_patch_count": patches["significant_patch_count"],
+                "significant_breach_percentage": f"{round(patches['significant_breach_ratio'] * 100, 2)}%",
+            })
+            res["analysis"] += (f" {patches['significant_patch_count']} patch(es) of at least "
+                                f"{self.min_patch_m2 / 10000:g} ha; largest {patches['largest_patch_area_m2']:,.0f} m².")
+        if pyramid_path:
+            res["pyramid_path"] = pyramid_path
+        return res
 
     def verify_zonal_truth(self, lat, lon, target_ndvi):
         if lat == "NOT_PROVIDED" or lon == "NOT_PROVIDED":
@@ -67,95 +219,124 @@ class PlanetaryVerifier:
             # 1. PARSE COORDINATES
             lat_f = float(str(lat).strip())
             lon_f = float(str(lon).strip())
-            
-            # 2. GEOSPATIAL POLYGON ALGORITHM (Spatial Truth)
-            # We buffer the point to create a 1km x 1km square (Polygon)
-            point = ee.Geometry.Point([lon_f, lat_f])
-            roi = point.buffer(500).bounds()
-
-            # PRINTING THE POLYGON FOR MANUAL VERIFICATION
-            poly_coords = roi.coordinates().getInfo()
-            print(f"\n🌐 GEOSPATIAL AUDIT BOX GENERATED:")
-            print(f"Center: {lat_f}, {lon_f}")
-            print(f"Polygon Corners: {poly_coords}")
-
-            # 3. TEMPORAL MEDIAN STACKING (30-Day Window)
-            # We look back 30 days from today to stack images and remove clouds
-            end_date = '2026-01-01'
-            start_date = '2025-09-01'
-
-            s2_data = (ee.ImageCollection(self.collection_id)
-                       .filterBounds(roi)
-                       .filterDate(start_date, end_date)
-                       .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20)))
-
-            if s2_data.size().getInfo() == 0:
-                return {"status": "ERROR", "reason": "No clear satellite imagery found in the 30-day window."}
-            
-            image_count = s2_data.size().getInfo()
+        except ValueError as e:
+            return {"status": "ERROR", "message": f"Verification Failure: {e}"}
 
-            if image_count == 0:
-                return {"status": "ERROR", "reason": "No imagery found in 90-day window."}
-                
-            # 4. NDVI CALCULATION & MEDIAN REDUCTION
-            def add_ndvi(img):
-                return img.addBands(img.normalizedDifference(['B8', 'B4']).rename('NDVI'))
-
-            # The .median() part handles the "Stacking" to find the statistical truth
-            median_image = s2_data.map(add_ndvi).select('NDVI').median().clip(roi)
-            
-            # 5. ZONAL MEAN (Polygon Statistics)
-            # We average all pixels inside our Polygon ROI
-            stats = median_image.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=roi,
-                scale=10 
-            )
+        # 2. GEOSPATIAL POLYGON ALGORITHM (Spatial Truth)
+        # We buffer the point to create a 1km x 1km square (Polygon). It is
+        # verified as a one-site group, exactly as verify_portfolio would.
+        bounds = site_bounds(lat_f, lon_f)
+        group = SiteGroup(bounds, [("site", lat_f, lon_f, bounds)])
 
-            actual_score = stats.get('NDVI').getInfo()
+        # PRINTING THE POLYGON FOR MANUAL VERIFICATION
+        min_lon, min_lat, max_lon, max_lat = bounds
+        print(f"\n🌐 GEOSPATIAL AUDIT BOX GENERATED:")
+        print(f"Center: {lat_f}, {lon_f}")
+        print(f"Polygon Corners: {[[min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat]]}")
 
-            # 6. --- NEW: BREACH RATIO ALGORITHM (Identifying Red Patches) ---
-            # Define a threshold for "Critical Degradation" (0.2 is standard for soil/rock/snow)
-            #
-            degradation_threshold = 0.2
+        res = self._verify_group(group, {"site": target_ndvi})["site"]
+        res.pop("shared_stack_sites", None)
+        print(res)
+        return res
 
+    def verify_portfolio(self, sites, merge_gap_m=0, max_group_span_m=5000, workers=4):
+        """Verifies many sites, fetching and median-stacking imagery once per group of overlapping ROIs.
 
-            # Create a mask where 1 = Breach (Red Patch), 0 = Healthy
-            breach_mask = median_image.lt(degradation_threshold)
-            mask_visual = breach_mask.visualize(palette=['black', 'white'])
+        `sites` is a list of dicts with "site_id", "lat", "lon" and "target_ndvi".
+        Each group's NDVI grid is pulled down once and every member gets zonal
+        statistics over its own 1km box, computed locally from that grid.
+        Groups run concurrently on `workers` threads.
+        """
+        index = SiteIndex(merge_gap_m=merge_gap_m, max_group_span_m=max_group_span_m)
+        results, targets = {}, {}
+        for site in sites:
+            if site["lat"] == "NOT_PROVIDED" or site["lon"] == "NOT_PROVIDED":
+                results[site["site_id"]] = self.verify_zonal_truth(site["lat"], site["lon"], site["target_ndvi"])
+                continue
+            try:
+                index.add(site["site_id"], float(str(site["lat"]).strip()), float(str(site["lon"]).strip()))
+            except ValueError as e:
+                results[site["site_id"]] = {"status": "ERROR", "reason": f"Verification Failure: {e}"}
+                continue
+            targets[site["site_id"]] = site["target_ndvi"]
 
-            # Calculate the percentage of pixels that are in breach
-            area_stats = breach_mask.reduceRegion(
-                reducer=ee.Reducer.mean(),
-                geometry=roi,
-                scale=10
-            )
-            breach_ratio = area_stats.get('NDVI').getInfo()
-            breach_percentage = round(breach_ratio * 100, 2)
-
-            # 6. FINAL VERDICT
-            is_breach = actual_score < float(target_ndvi)
-
-            res= {
-                "status": "SUCCESS",
-                "image_count":image_count,
-                "actual_ndvi": round(actual_score, 4),
-                "target_ndvi": float(target_ndvi),
-                "breach_area_percentage": f"{breach_percentage}%",
-                "is_breach": is_breach,
-                "verdict": "BREACH: ADJUST MARGIN UP" if is_breach else "COMPLIANT: APPLY DISCOUNT",
-                "map_thumb_url": median_image.getThumbURL({
-                    'min': 0, 'max': 1, 
-                    'palette': ['red', 'yellow', 'green'],
-                    'dimensions': 512
-                }),
-                "mask_thumb_url": mask_visual.getThumbURL({'dimensions': 512}),
-                "analysis": f"Critical degradation detected in {breach_percentage}% of the site polygon."
-            }
-            print(res)
+        groups = index.groups()
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ee-group") as pool:
+            for group_results in pool.map(lambda g: self._verify_group(g, targets), groups):
+                results.update(group_results)
+
+        dedup = index.stats(groups)
+        print(f"🛰️ {dedup['sites']} sites served by {dedup['imagery_stacks']} imagery stacks "
+              f"(dedup ratio {dedup['dedup_ratio']:.0%})")
+        return {"results": results, "dedup": dedup}
+
+    def _verify_group(self, group, targets):
+        results = {}
+        try:
+            group_roi = ee.Geometry.Rectangle(list(group.bounds))
+            median_stack, image_count = self._median_stack(group_roi)
+            group_grid = None
+            if image_count and self._grid_pixels(group.bounds) <= MAX_SAMPLE_PX:
+                group_grid = self._fetch_ndvi_grid(median_stack.clip(group_roi), group_roi)
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            failure = {"status": "ERROR", "reason": f"Earth Engine unavailable: {e}", "retryable": True}
+            return {site_id: dict(failure) for site_id, *_ in group.members}
+        except Exception as e:
+            # The whole group fails together
+            return {site_id: {"status": "ERROR", "reason": f"Verification Failure: {e}"}
+                    for site_id, *_ in group.members}
+
+        for site_id, lat_f, lon_f, bounds in group.members:
+            if image_count == 0:
+                results[site_id] = {"status": "ERROR", "reason": "No clear satellite imagery found in the 30-day window."}
+                continue
+            try:
+                if group_grid is not None:
+                    grid = crop_to_bounds(group_grid, group.bounds, bounds)
+                else:
+                    # Group too large for one sampleRectangle: fetch each member's own box
+                    roi = ee.Geometry.Rectangle(list(bounds))
+                    grid = self._fetch_ndvi_grid(median_stack.clip(roi), roi)
+                res = self._local_verdict(grid, targets[site_id], image_count, site=(lat_f, lon_f))
+                res["shared_stack_sites"] = len(group.members)
+                results[site_id] = res
+            except (CircuitOpenError, DeadlineExceeded) as e:
+                results[site_id] = {"status": "ERROR", "reason": f"Earth Engine unavailable: {e}", "retryable": True}
+            except Exception as e:
+                results[site_id] = {"status": "ERROR", "reason": f"Verification Failure: {e}"}
+        return results
+
+    def drill_down(self, lat, lon, polygon=None, bounds=None, scale_m=10):
+        """Zonal stats + imagery for any sub-polygon/zoom of a verified site.
+
+        Served from the site's stored tile pyramid (nearest level to scale_m);
+        the median stack is only built if this window has no pyramid yet.
+        polygon is a list of (lon, lat) vertices, bounds is (min_lon, min_lat, max_lon, max_lat).
+        """
+        try:
+            lat_f, lon_f = float(str(lat).strip()), float(str(lon).strip())
+            path = self.pyramid_path(lat_f, lon_f)
+            if not os.path.exists(path):
+                roi = ee.Geometry.Rectangle(list(site_bounds(lat_f, lon_f)))
+                median_stack, image_count = self._median_stack(roi)
+                if image_count == 0:
+                    return {"status": "ERROR", "reason": "No clear satellite imagery found in the 30-day window."}
+                grid = self._fetch_ndvi_grid(median_stack.clip(roi), roi)
+                NDVIPyramid.build(grid, site_bounds(lat_f, lon_f),
+                                  window=(self.start_date, self.end_date)).save(path)
+
+            # One window for stats and imagery: a polygon alone zooms to its own box
+            if polygon is not None and bounds is None:
+                bounds = polygon_bounds(polygon)
+            pyramid = NDVIPyramid.load(path)
+            res = pyramid.zonal_stats(polygon=polygon, bounds=bounds, scale_m=scale_m)
+            if res["status"] == "SUCCESS":
+                res.update(pyramid.imagery(self.image_cache, bounds=bounds, scale_m=scale_m))
             return res
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            return {"status": "ERROR", "reason": f"Earth Engine unavailable: {e}", "retryable": True}
         except Exception as e:
-            return {"status": "ERROR", "message": f"Verification Failure: {e}"}
+            return {"status": "ERROR", "reason": f"Drill-down Failure: {e}"}
 
 # --- TEST BLOCK ---
 if __name__ == "__main__":
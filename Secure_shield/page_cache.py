@@ -0,0 +1,75 @@
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+
+# Pages without any of these words carry no KPI data (same list LegalBrain scans for)
+KPI_KEYWORDS = ["project site", "ndvi", "bps", "latitude"]
+
+def page_fingerprint(text):
+    """Hash of the exact page text: cached results hold raw offsets and text, so only identical pages match."""
+    return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def keyword_hits(text):
+    lowered = text.lower()
+    return [kw for kw in KPI_KEYWORDS if kw in lowered]
+
+
+class PageFingerprintCache:
+    """
+    Cross-document cache of per-page results keyed by page fingerprint.
+
+    LMA facility agreements are mostly shared clause boilerplate, so the same
+    page shows up across the whole portfolio. Each entry is a dict of whatever
+    stages have computed for that page (redaction boxes, keyword hits,
+    the "no KPI content" verdict); a page seen before is answered in O(1).
+    Lookups are counted per stage, so one stage's misses never dilute
+    another stage's reuse ratio.
+    """
+
+    def __init__(self, max_entries=50_000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # Shared by every session and pipeline worker
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: [0, 0])  # stage -> [lookups, hits]
+
+    def get(self, fingerprint, field=None, stage="masking"):
+        """Cached entry (or one field of it); None counts as a miss for `stage`."""
+        with self._lock:
+            counter = self._counters[stage]
+            counter[0] += 1
+            entry = self._entries.get(fingerprint)
+            if entry is None or (field is not None and field not in entry):
+                return None
+            self._entries.move_to_end(fingerprint)
+            counter[1] += 1
+            return dict(entry) if field is None else entry[field]
+
+    def put(self, fingerprint, **fields):
+        """Merges fields into the page's entry, evicting the oldest page when full."""
+        with self._lock:
+            entry = self._entries.setdefault(fingerprint, {})
+            entry.update(fields)
+            self._entries.move_to_end(fingerprint)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return dict(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Cache-wide counters since process start, per stage."""
+        with self._lock:
+            return {
+                "unique_pages": len(self._entries),
+                "stages": {
+                    stage: {
+                        "page_lookups": lookups,
+                        "pages_reused": hits,
+                        "page_reuse_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                    }
+                    for stage, (lookups, hits) in self._counters.items()
+                },
+            }
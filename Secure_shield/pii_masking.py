@@ -1,10 +1,17 @@
 import fitz  # PyMuPDF
 import re
 import os
+from bisect import bisect_right
 from fpdf import FPDF
 
+from concurrency import PDF_LOCK
+from Secure_shield.page_cache import page_fingerprint, keyword_hits
+from Secure_shield.span_map import RedactionSpanMap
+
 class SecureShield:
-    def __init__(self):
+    def __init__(self, page_cache=None):
+        # Optional PageFingerprintCache shared across documents
+        self.page_cache = page_cache
         # Enhanced regex to ensure no "leakage" of sensitive LMA data
         self.patterns = {
             # Entities - Catches the uppercase names on Page 1
@@ -22,40 +29,287 @@ class SecureShield:
         }
 
     def mask_text(self, text):
-        masked_text = text
-        for label, pattern in self.patterns.items():
-            masked_text = re.sub(pattern, f"[{label}_REDACTED]", masked_text)
+        masked_text, _ = self.mask_text_with_spans(text)
         return masked_text
 
-    def process_pdf_bytes(self, pdf_stream, filename):
+    def mask_text_with_spans(self, text):
+        """Masks text and returns (masked_text, spans).
+
+        Same output as substituting each pattern in turn over the already-masked
+        text; alongside it we track which raw characters every token replaced.
+        Each span is (label, start, end, masked_start, masked_end). A later
+        match that swallows an earlier token takes over its raw range.
+        """
+        segments = self._mask_segments(text)
+        spans, masked_len = [], 0
+        for out_text, raw_start, raw_end, label in segments:
+            if label:
+                spans.append((label, raw_start, raw_end, masked_len, masked_len + len(out_text)))
+            masked_len += len(out_text)
+        return "".join(seg[0] for seg in segments), spans
+
+    def _mask_segments(self, text):
+        # Segments of the masked text: (out_text, raw_start, raw_end, label).
+        # label None = raw text copied through, otherwise a redaction token.
+        segments = [(text, 0, len(text), None)]
+        for label, pattern in self.patterns.items():
+            current = "".join(seg[0] for seg in segments)
+            matches = [m.span() for m in re.finditer(pattern, current) if m.end() > m.start()]
+            if matches:
+                segments = self._substitute(segments, matches, f"[{label}_REDACTED]", label)
+        return segments
+
+    @staticmethod
+    def _masked_offsets(segments, raw_offsets):
+        """Maps sorted raw-text offsets into the masked text; an offset inside a token maps past it."""
+        out, pos, i = [], 0, 0
+        for out_text, r0, r1, label in segments:
+            while i < len(raw_offsets):
+                b = raw_offsets[i]
+                if label is None and r0 <= b <= r1:
+                    out.append(pos + b - r0)
+                elif label and r0 < b < r1:
+                    out.append(pos + len(out_text))
+                elif b <= r0:
+                    out.append(pos)
+                else:
+                    break
+                i += 1
+            pos += len(out_text)
+        return out + [pos] * (len(raw_offsets) - i)
+
+    @staticmethod
+    def _substitute(segments, matches, token, label):
+        """Replaces (sorted, non-overlapping) match ranges of the masked text with token."""
+        out, pos, j = [], 0, 0
+        covered = None  # raw range swallowed so far by the match in progress
+        for out_text, r0, r1, seg_label in segments:
+            o0, o1 = pos, pos + len(out_text)
+            pos = o1
+            cuts = sorted({o0, o1} | {c for m in matches for c in m if o0 < c < o1})
+            for c0, c1 in zip(cuts, cuts[1:]):
+                while j < len(matches) and matches[j][1] <= c0:
+                    j += 1
+                inside = j < len(matches) and matches[j][0] <= c0
+                if seg_label is None:
+                    sub = (out_text[c0 - o0:c1 - o0], r0 + c0 - o0, r0 + c1 - o0, None)
+                elif (c0, c1) == (o0, o1):
+                    sub = (out_text, r0, r1, seg_label)
+                else:
+                    # Leftover piece of a token cut by this match; it owns no raw text
+                    edge = r0 if c0 == o0 else r1
+                    sub = (out_text[c0 - o0:c1 - o0], edge, edge, "")
+
+                if not inside:
+                    out.append(sub)
+                    continue
+                raw = (sub[1], sub[2]) if seg_label is None else (r0, r1)
+                covered = raw if covered is None else (min(covered[0], raw[0]), max(covered[1], raw[1]))
+                if c1 == matches[j][1]:
+                    out.append((token, covered[0], covered[1], label))
+                    covered = None
+        return out
+
+    def locate_on_page(self, page, snippet):
+        """Bounding box of a matched snippet on the source page (union of its lines)."""
+        rects = []
+        for line in snippet.splitlines():
+            line = line.strip()
+            if len(line) < 2:
+                continue
+            hits = page.search_for(line)
+            if hits:
+                rects.append(hits[0])
+        if not rects:
+            return None
+        return [min(r.x0 for r in rects), min(r.y0 for r in rects),
+                max(r.x1 for r in rects), max(r.y1 for r in rects)]
+
+    def process_pdf_bytes(self, pdf_stream, filename, doc_id=None):
         """Processes PDF from FastAPI stream (no need to save to disk first)."""
-        doc = fitz.open(stream=pdf_stream, filetype="pdf")
-        full_raw_text = ""
-        
-        # Memory-efficient extraction
-        for page in doc:
-            full_raw_text += page.get_text("text")
+        job = MaskingJob(self, pdf_stream, filename, doc_id=doc_id)
+        job.locate_rest()
+        return job.result()
 
-        safe_text = self.mask_text(full_raw_text)
-        doc.close()
-        
-        return {
-            "doc_name": filename,
-            "safe_content": safe_text,
-            "status": "Ready for Extraction"
-        }
-    def save_masked_pdf(self, safe_text, output_filename):
+    def _locate_page(self, page, page_text, snippets):
+        """Bounding boxes of the redacted snippets on one page; returns (boxes, reused_from_cache)."""
+        fingerprint = None
+        if self.page_cache is not None:
+            fingerprint = page_fingerprint(page_text)
+            cached = self.page_cache.get(fingerprint, "boxes")
+            if cached is not None and all(s in cached for s in snippets):
+                return cached, True
+
+        boxes = {s: self.locate_on_page(page, s) for s in snippets}
+        if fingerprint is not None:
+            self.page_cache.put(fingerprint, boxes=boxes)
+        return boxes, False
+
+    def save_masked_pdf(self, safe_text, output_filename, span_map=None):
         
             pdf = FPDF()
             pdf.set_auto_page_break(auto=True, margin=15)
-            pdf.add_page()
             pdf.set_font("Arial", size=10)
-            
-            # Write the masked text into the PDF
-            # We encode/decode to handle potential special characters
-            clean_text = safe_text.encode('latin-1', 'ignore').decode('latin-1')
-            pdf.multi_cell(0, 10, clean_text)
+
+            # Without a span map the whole text flows as one block. With one, each
+            # source page starts a new PDF page and we record where it landed, so
+            # later phases can jump straight to the right page.
+            if span_map is None or not span_map.masked_page_offsets:
+                chunks = [safe_text]
+            else:
+                bounds = span_map.masked_page_offsets + [len(safe_text)]
+                chunks = [safe_text[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+                span_map.masked_pdf_pages = []
+
+            for chunk in chunks:
+                pdf.add_page()
+                if span_map is not None and span_map.masked_page_offsets:
+                    span_map.masked_pdf_pages.append(pdf.page_no() - 1)
+                # Write the masked text into the PDF
+                # We encode/decode to handle potential special characters
+                clean_text = chunk.encode('latin-1', 'ignore').decode('latin-1')
+                pdf.multi_cell(0, 10, clean_text)
+
+            if span_map is not None:
+                span_map.masked_pdf_page_count = pdf.page_no()
             
             pdf.output(output_filename)
             print(f"Redacted PDF saved: {output_filename}")
 
+
+class MaskingJob:
+    """
+    Masking of one PDF, split so the preview can ship early.
+
+    The patterns run once over the whole document text when the job is
+    created, so a name broken across a page break is redacted exactly as in
+    a single pass and the safe text is final straight away. locate_rest()
+    then walks the pages to place each redaction on the source PDF (the slow
+    part), e.g. on a background thread.
+    """
+
+    def __init__(self, shield, pdf_stream, filename, doc_id=None):
+        self.shield = shield
+        self.filename = filename
+        with PDF_LOCK:
+            self.doc = fitz.open(stream=pdf_stream, filetype="pdf")
+            self.page_count = len(self.doc)
+        self.page_texts = []
+        for page_idx in range(self.page_count):
+            # One page per lock hold, so other sessions' PDF work can interleave
+            with PDF_LOCK:
+                self.page_texts.append(self.doc[page_idx].get_text("text"))
+
+        raw_text = "".join(self.page_texts)
+        raw_offsets, raw_len = [], 0
+        for page_text in self.page_texts:
+            raw_offsets.append(raw_len)
+            raw_len += len(page_text)
+        segments = shield._mask_segments(raw_text)
+        self.safe_text = "".join(seg[0] for seg in segments)
+
+        # A token cut by a page break stays with the page where its match starts
+        self.span_map = RedactionSpanMap(doc_id)
+        masked_offsets = shield._masked_offsets(segments, raw_offsets)
+        for raw_offset, masked_offset in zip(raw_offsets, masked_offsets):
+            self.span_map.add_page(raw_offset, masked_offset)
+        bounds = masked_offsets + [len(self.safe_text)]
+        self.safe_pages = [self.safe_text[bounds[i]:bounds[i + 1]] for i in range(self.page_count)]
+
+        # Per page: (span index, the part of its raw text on that page) to locate later
+        self._snippets = [[] for _ in range(self.page_count)]
+        masked_len = 0
+        for out_text, start, end, label in segments:
+            if label:
+                page = max(bisect_right(raw_offsets, start) - 1, 0)
+                page_end = raw_offsets[page + 1] if page + 1 < self.page_count else len(raw_text)
+                self._snippets[page].append((len(self.span_map.spans), raw_text[start:min(end, page_end)]))
+                self.span_map.add_span(label, start, end, masked_len, masked_len + len(out_text), page, None)
+            masked_len += len(out_text)
+
+        # Source pages whose masked text mentions a KPI keyword
+        self.kpi_pages = [i for i, page in enumerate(self.safe_pages) if keyword_hits(page)]
+        self.pages_located = 0
+        self.pages_reused = 0
+
+    @property
+    def done(self):
+        return self.pages_located >= self.page_count
+
+    def locate_rest(self):
+        """Finds the bounding box of every redaction on its source page, page by page."""
+        while not self.done:
+            page_idx = self.pages_located
+            snippets = self._snippets[page_idx]
+            # One page per lock hold, so a long background job never starves
+            # other sessions' PDF work
+            with PDF_LOCK:
+                boxes, reused = self.shield._locate_page(self.doc[page_idx], self.page_texts[page_idx],
+                                                         [snippet for _, snippet in snippets])
+            self.pages_reused += reused
+            for span_idx, snippet in snippets:
+                self.span_map.set_bbox(span_idx, boxes.get(snippet))
+            self.pages_located += 1
+
+        if not self.doc.is_closed:
+            with PDF_LOCK:
+                self.doc.close()
+        return self.span_map
+
+    def result(self):
+        return {
+            "doc_name": self.filename,
+            "safe_content": self.safe_text,
+            "span_map": self.span_map,
+            "pages_masked": self.page_count,
+            "pages_reused": self.pages_reused,
+            "kpi_pages": list(self.kpi_pages),
+            "page_reuse_ratio": round(self.pages_reused / self.pages_located, 4) if self.pages_located else 0.0,
+            "status": "Ready for Extraction" if self.done else "Locating redactions"
+        }
+
+
+# --- TEST BLOCK ---
+if __name__ == "__main__":
+    import sys
+
+    shield = SecureShield()
+
+    def legacy_mask_text(text):
+        # The original sequential substitution the span-tracking masker must reproduce
+        for label, pattern in shield.patterns.items():
+            text = re.sub(pattern, f"[{label}_REDACTED]", text)
+        return text
+
+    samples = ["Contact: John Smith\njohn.smith@bank.com", "(3) DANIEL DEUTDEFFXXX (as Agent)"]
+    for sample in samples:
+        masked, spans = shield.mask_text_with_spans(sample)
+        assert masked == legacy_mask_text(sample), (masked, legacy_mask_text(sample))
+        for label, start, end, m_start, m_end in spans:
+            assert masked[m_start:m_end] == f"[{label}_REDACTED]"
+        print(masked.replace("\n", " | "))
+
+    # A contact name split across a page break must be masked as in one pass
+    with PDF_LOCK, fitz.open() as doc:
+        doc.new_page().insert_text((72, 72), "Notices. Attention:")
+        doc.new_page().insert_text((72, 72), "John Smith")
+        split_pdf = doc.tobytes()
+        split_text = "".join(page.get_text("text") for page in doc)
+    split = shield.process_pdf_bytes(split_pdf, "split.pdf")
+    assert split["safe_content"] == legacy_mask_text(split_text), split["safe_content"]
+    assert "John" not in split["safe_content"]
+    span_map = split["span_map"]
+    assert [s[5] for s in span_map.spans] == [0] and span_map.spans[0][6] is not None
+    assert span_map.masked_page_offsets == [0, len(split["safe_content"])]
+    print(repr(split["safe_content"]))
+
+    path = sys.argv[1] if len(sys.argv) > 1 else "data/lma_150_dataset/LMA_Success_1.pdf"
+    with open(path, "rb") as f:
+        pdf_bytes = f.read()
+    with PDF_LOCK, fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+        raw_text = "".join(page.get_text("text") for page in doc)
+
+    result = shield.process_pdf_bytes(pdf_bytes, os.path.basename(path))
+    assert result["safe_content"] == legacy_mask_text(raw_text), "masked output differs from sequential masking"
+    print(f"{path}: masked output identical to sequential masking "
+          f"({result['span_map'].stats()['total_redactions']} redactions)")
@@ -0,0 +1,116 @@
+import json
+import os
+from bisect import bisect_right
+from collections import Counter
+
+
+class RedactionSpanMap:
+    """
+    Compact record of every redaction made by SecureShield.
+
+    Each span is stored as one row:
+        [label, start, end, masked_start, masked_end, page, [x0, y0, x1, y1]]
+    where start/end index the raw extracted text, masked_start/masked_end index
+    the safe text, and page/bbox locate the redaction on the source PDF.
+    """
+
+    def __init__(self, doc_id=None):
+        self.doc_id = doc_id
+        self.spans = []
+        # Offset where each page begins in the raw and masked text streams
+        self.page_offsets = []
+        self.masked_page_offsets = []
+        # First page of the re-typeset masked PDF for each source page
+        self.masked_pdf_pages = []
+        self.masked_pdf_page_count = 0
+
+    # --- BUILDING ---
+    def add_page(self, raw_offset, masked_offset):
+        self.page_offsets.append(raw_offset)
+        self.masked_page_offsets.append(masked_offset)
+
+    def add_span(self, label, start, end, masked_start, masked_end, page, bbox):
+        bbox = [round(float(v), 2) for v in bbox] if bbox else None
+        self.spans.append([label, start, end, masked_start, masked_end, page, bbox])
+
+    def set_bbox(self, index, bbox):
+        self.spans[index][6] = [round(float(v), 2) for v in bbox] if bbox else None
+
+    # --- LOOKUPS ---
+    def page_of(self, masked_offset):
+        """Source page (0-based) that a position in the safe text came from."""
+        if not self.masked_page_offsets:
+            return None
+        return max(bisect_right(self.masked_page_offsets, masked_offset) - 1, 0)
+
+    def masked_pdf_pages_for(self, masked_offset):
+        """Range of masked PDF pages that may contain a position of the safe text."""
+        page = self.page_of(masked_offset)
+        if page is None or not self.masked_pdf_pages:
+            return None
+        first = self.masked_pdf_pages[page]
+        if page + 1 < len(self.masked_pdf_pages):
+            # A match may straddle into the next source page's first masked page
+            return range(first, self.masked_pdf_pages[page + 1] + 1)
+        return range(first, max(self.masked_pdf_page_count, first + 1))
+
+    def masked_pdf_pages_of(self, source_pages):
+        """Masked PDF pages holding the text of the given source pages (None without a page map)."""
+        if not self.masked_pdf_pages:
+            return None
+        bounds = self.masked_pdf_pages + [max(self.masked_pdf_page_count, self.masked_pdf_pages[-1] + 1)]
+        return sorted({p for src in source_pages for p in range(bounds[src], max(bounds[src + 1], bounds[src] + 1))})
+
+    def spans_on_page(self, page):
+        return [s for s in self.spans if s[5] == page]
+
+    def span_at(self, masked_offset):
+        """Redaction covering a position of the safe text, if any."""
+        starts = [s[3] for s in self.spans]
+        idx = bisect_right(starts, masked_offset) - 1
+        if idx >= 0 and self.spans[idx][3] <= masked_offset < self.spans[idx][4]:
+            return self.spans[idx]
+        return None
+
+    def stats(self):
+        """Redaction statistics for auditors, without re-reading the PDF."""
+        return {
+            "doc_id": self.doc_id,
+            "total_redactions": len(self.spans),
+            "pages_scanned": len(self.page_offsets),
+            "by_label": dict(Counter(s[0] for s in self.spans)),
+            "by_page": {p + 1: n for p, n in sorted(Counter(s[5] for s in self.spans).items())},
+            "redacted_chars": sum(s[2] - s[1] for s in self.spans),
+        }
+
+    # --- PERSISTENCE ---
+    def to_dict(self):
+        return {
+            "doc_id": self.doc_id,
+            "page_offsets": self.page_offsets,
+            "masked_page_offsets": self.masked_page_offsets,
+            "masked_pdf_pages": self.masked_pdf_pages,
+            "masked_pdf_page_count": self.masked_pdf_page_count,
+            "spans": self.spans,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        span_map = cls(data.get("doc_id"))
+        span_map.page_offsets = data.get("page_offsets", [])
+        span_map.masked_page_offsets = data.get("masked_page_offsets", [])
+        span_map.masked_pdf_pages = data.get("masked_pdf_pages", [])
+        span_map.masked_pdf_page_count = data.get("masked_pdf_page_count", 0)
+        span_map.spans = data.get("spans", [])
+        return span_map
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
@@ -1,95 +1,281 @@
 import os
 import hashlib
+import threading
 import fitz  # PyMuPDF
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pydantic import BaseModel
 
 # Import your custom modules
-from Secure_shield.pii_masking import SecureShield
-from Extraction_Engine.extraction_bounding_box import LegalBrain
-from Planetary_verifier.verifier import PlanetaryVerifier
+from Secure_shield.pii_masking import SecureShield, MaskingJob
+from Secure_shield.span_map import RedactionSpanMap
+from Secure_shield.page_cache import PageFingerprintCache
+from Extraction_Engine.extraction_bounding_box import LegalBrain, gemini_guard
+from Planetary_verifier.verifier import PlanetaryVerifier, earth_engine_guard
 from trust_ledger.trust_ledger import TrustLedger
+from trust_ledger.audit_store import AuditHistoryStore
+from pipeline import AuditPipeline, Stage, check_result
+from concurrency import AuditVault, KeyedLocks, SingleFlight, PDF_LOCK
 
 # Initialize Directories
 os.makedirs("static", exist_ok=True)
 os.makedirs("reports", exist_ok=True)
 
 # Initialize Classes
-shield = SecureShield()
-brain = LegalBrain()
+# Page results are shared across every document in the portfolio
+page_cache = PageFingerprintCache()
+shield = SecureShield(page_cache=page_cache)
+brain = LegalBrain(page_cache=page_cache)
 verifier = PlanetaryVerifier()
-ledger = TrustLedger(base_margin_bps=150)
+audit_store = AuditHistoryStore("reports/audit_store")
+ledger = TrustLedger(base_margin_bps=150, history=audit_store)
 
-# This serves as our in-memory database
-audit_vault = {}
+# Finishes masking long contracts after the Phase 1 preview has been returned
+masking_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="masking")
+PREVIEW_CHARS = 1200
+SECURED = "🔒 PII Secured"
+SECURING = "⏳ Text secured, locating redactions on the PDF"
 
-def local_masking(file_bytes, filename):
-    """Replaces @app.post('/masking')"""
+# This serves as our in-memory database (shared by every Streamlit session)
+audit_vault = AuditVault()
+
+# Concurrent identical requests share one run. The per-document lock only
+# guards the masking check-and-claim in the vault, never a Gemini or Earth
+# Engine call; every other phase writes its results with one atomic update.
+inflight = SingleFlight()
+doc_locks = KeyedLocks()
+
+def _coalesced(key, fn, *args):
+    """Runs fn once per in-flight key; callers arriving meanwhile share its result."""
+    result, _ = inflight.do(key, fn, *args)
+    return result
+
+def local_masking(file_bytes, filename, progressive=True):
+    """Replaces @app.post('/masking')
+
+    The whole text is masked up front (cheap, and a name split across a page
+    break is caught). With progressive=True, placing the redactions on the
+    PDF and writing the masked PDF finish in the background, and later
+    phases wait on that handle only when they need it.
+    """
     doc_id = hashlib.md5(file_bytes).hexdigest()
+    # The same contract re-uploaded by another session: reuse its masking
+    # straight away, without queueing behind anything
+    if _reusable_masking(audit_vault.get(doc_id)):
+        return _masking_response(doc_id, progressive)
+    return _coalesced(("masking", doc_id), _mask_document, file_bytes, filename, doc_id, progressive)
+
+def _reusable_masking(record):
+    """True when an earlier upload's masking is finished or still running (not failed)."""
+    pending = record.get("masking") if record else None
+    failed = pending is not None and pending.done() and pending.exception() is not None
+    return bool(record) and not failed and (record.get("mask_summary") is not None or pending is not None)
+
+def _mask_document(file_bytes, filename, doc_id, progressive):
+    # Check-and-claim under the doc lock (local CPU work only), so a re-upload
+    # never wipes the later phases another session may be in the middle of
+    with doc_locks(doc_id):
+        if _reusable_masking(audit_vault.get(doc_id)):
+            job = None
+        else:
+            # Process PII (the safe text is final here; only redaction boxes remain)
+            job = MaskingJob(shield, file_bytes, filename, doc_id=doc_id)
+            preview = job.safe_text[:PREVIEW_CHARS]
+            audit_vault.update(doc_id, preview=preview, total_pages=job.page_count,
+                               masking=None, masking_error=None)
+            pending = None
+            if progressive and not job.done:
+                pending = masking_pool.submit(_finish_masking, job, doc_id)
+                audit_vault.update(doc_id, masking=pending)
+    if job is None:
+        return _masking_response(doc_id, progressive)
+
+    if pending is not None:
+        return {
+            "doc_id": doc_id,
+            "preview": preview,
+            "total_pages": job.page_count,
+            "status": SECURING
+        }
+
+    summary = _finish_masking(job, doc_id)
+    return {"doc_id": doc_id, "preview": preview, **summary, "status": SECURED}
+
+def _finish_masking(job, doc_id):
+    try:
+        return _complete_masking(job, doc_id)
+    except Exception as e:
+        # Kept on the record so later phases report why, and a re-upload retries
+        audit_vault.update(doc_id, masking_error=str(e))
+        raise
+
+def _complete_masking(job, doc_id):
+    job.locate_rest()
+    safe_text = job.safe_text
+    span_map = job.span_map
     
-    # Process PII
-    result = shield.process_pdf_bytes(file_bytes, filename)
-    safe_text = result["safe_content"]
-    
-    # Save Masked PDF
+    # Save Masked PDF (records which masked page each source page landed on)
     masked_pdf_path = f"static/masked_{doc_id}.pdf"
-    shield.save_masked_pdf(safe_text, masked_pdf_path)
+    shield.save_masked_pdf(safe_text, masked_pdf_path, span_map=span_map)
+    span_map_path = span_map.save(f"static/spans_{doc_id}.json")
     
-    audit_vault[doc_id] = {
-        "safe_text": safe_text,
-        "path": masked_pdf_path
+    result = job.result()
+    summary = {
+        "redactions": span_map.stats(),
+        "pages_masked": result["pages_masked"],
+        "pages_reused": result["pages_reused"],
+        "page_reuse_ratio": result["page_reuse_ratio"],
     }
-    
+    audit_vault.update(doc_id,
+        kpi_pages=result["kpi_pages"],
+        safe_text=safe_text,
+        path=masked_pdf_path,
+        span_map=span_map,
+        span_map_path=span_map_path,
+        mask_summary=summary
+    )
+    return summary
+
+def _masking_response(doc_id, progressive):
+    """Phase 1 response for a document that is already masked (or being masked)."""
+    record = audit_vault.get(doc_id)
+    if record.get("masking") is not None and not progressive:
+        record = _masked_record(doc_id)
+    if record.get("mask_summary") is None:
+        return {
+            "doc_id": doc_id,
+            "preview": record["preview"],
+            "total_pages": record.get("total_pages"),
+            "status": SECURING
+        }
+    return {"doc_id": doc_id, "preview": record["preview"], **record["mask_summary"], "status": SECURED}
+
+def _masked_record(doc_id):
+    """Vault record once masking has fully finished (waits on the background handle)."""
+    record = audit_vault.get(doc_id)
+    pending = record.get("masking") if record else None
+    if pending is not None:
+        pending.result()
+        record = audit_vault.get(doc_id)
+    return record
+
+def candidate_pages(record, target, page_count):
+    """Masked PDF pages worth searching for a target, via the redaction span map."""
+    span_map = record.get("span_map")
+    safe_text = record.get("safe_text", "")
+    if span_map is None or not span_map.masked_pdf_pages:
+        return range(page_count)
+
+    pages = set()
+    pos = safe_text.find(target)
+    while pos != -1:
+        pages.update(span_map.masked_pdf_pages_for(pos) or [])
+        pos = safe_text.find(target, pos + 1)
+    # Fall back to a full scan if the text stream and the PDF disagree
+    return sorted(p for p in pages if p < page_count) or range(page_count)
+
+def redaction_stats(doc_id: str):
+    """Redaction statistics for auditors, read from the stored span map."""
+    try:
+        record = _masked_record(doc_id)
+    except Exception as e:
+        return {"status": "ERROR", "reason": f"Masking failed: {e}"}
+    if record and record.get("span_map") is not None:
+        return record["span_map"].stats()
+    span_map_path = f"static/spans_{doc_id}.json"
+    if os.path.exists(span_map_path):
+        return RedactionSpanMap.load(span_map_path).stats()
+    return {"status": "ERROR", "reason": "Doc ID not found"}
+
+def portfolio_page_reuse(doc_ids=None):
+    """Page reuse per stage.
+
+    With doc_ids: totals for just those documents (one portfolio run).
+    Without: the shared page cache's counters since process start.
+    """
+    if doc_ids is None:
+        return page_cache.stats()
+    masked = reused = scanned = skipped = 0
+    for doc_id in doc_ids:
+        record = audit_vault.get(doc_id) or {}
+        summary = record.get("mask_summary") or {}
+        masked += summary.get("pages_masked", 0)
+        reused += summary.get("pages_reused", 0)
+        pages = record.get("extraction_pages") or {}
+        scanned += pages.get("pages_scanned", 0)
+        skipped += pages.get("pages_skipped", 0)
     return {
-        "doc_id": doc_id,
-        "preview": safe_text[:1200],
-        "status": "🔒 PII Secured"
+        "masking": {"pages": masked, "pages_reused": reused,
+                    "page_reuse_ratio": round(reused / masked, 4) if masked else 0.0},
+        "extraction": {"pages": scanned + skipped, "pages_skipped": skipped,
+                       "skip_ratio": round(skipped / (scanned + skipped), 4) if scanned + skipped else 0.0},
     }
 
+def call_metrics():
+    """Retry, hedge and circuit-breaker metrics for the external backends."""
+    return {"gemini": gemini_guard.metrics(), "earth_engine": earth_engine_guard.metrics()}
+
 def local_extraction(doc_id: str):
     """Replaces @app.post('/extraction/{doc_id}')"""
-    record = audit_vault.get(doc_id)
+    return _coalesced(("extraction", doc_id), _extract_document, doc_id)
+
+def _extract_document(doc_id):
+    try:
+        record = _masked_record(doc_id)
+    except Exception as e:
+        return {"status": "ERROR", "reason": f"Masking failed: {e}"}
     if not record:
         return {"status": "ERROR", "reason": "Doc ID not found"}
         
     pdf_path = record["path"]
-    extracted_data = brain.run(pdf_path)
-    audit_vault[doc_id]["extracted_data"] = extracted_data
-    
-    doc = fitz.open(pdf_path)
-    found_pages = []
-
-    # Highlight Logic
-    targets = [
-        str(extracted_data['ndvi']['value']),
-        str(extracted_data['margin']['value']),
-    ]
-    gps_value = str(extracted_data['gps']['value'])
-    gps_parts = [p.strip() for p in gps_value.replace(',', ' ').split() if len(p) > 2]
-    targets.extend(gps_parts)
-
-    for target in targets:
-        if not target or target == "None": continue
-        for page_idx in range(len(doc)):
-            page = doc[page_idx]
-            text_instances = page.search_for(target)
-            if text_instances:
-                found_pages.append(page_idx)
-                for inst in text_instances:
-                    shape = page.new_shape()
-                    shape.draw_rect(inst)
-                    shape.finish(color=(1, 0, 0), width=2)
-                    shape.commit(overlay=True)
-
-    valid_pages = [p for p in found_pages if p < len(doc)]
-    display_page_idx = valid_pages[0] if valid_pages else 0
-    
-    timestamp = int(datetime.now().timestamp())
-    img_filename = f"evidence_{doc_id}_{timestamp}.png"
-    img_path = f"static/{img_filename}"
-    
-    pix = doc[display_page_idx].get_pixmap(dpi=150)
-    pix.save(img_path)
+    # The shield already judged every source page for KPI keywords: map its
+    # verdict onto the masked PDF instead of re-scanning each page
+    span_map = record.get("span_map")
+    kpi_pages = record.get("kpi_pages")
+    pages = span_map.masked_pdf_pages_of(kpi_pages) if span_map is not None and kpi_pages is not None else None
+    extracted_data = brain.run(pdf_path, pages=pages)
+
+    # PyMuPDF is not thread-safe (background masking may be running)
+    with PDF_LOCK:
+        doc = fitz.open(pdf_path)
+        scanned = len(doc) if pages is None else len(pages)
+        audit_vault.update(doc_id, extracted_data=extracted_data,
+                           extraction_pages={"pages_scanned": scanned, "pages_skipped": len(doc) - scanned})
+
+        found_pages = []
+
+        # Highlight Logic
+        targets = [
+            str(extracted_data['ndvi']['value']),
+            str(extracted_data['margin']['value']),
+        ]
+        gps_value = str(extracted_data['gps']['value'])
+        gps_parts = [p.strip() for p in gps_value.replace(',', ' ').split() if len(p) > 2]
+        targets.extend(gps_parts)
+
+        for target in targets:
+            if not target or target == "None": continue
+            for page_idx in candidate_pages(record, target, len(doc)):
+                page = doc[page_idx]
+                text_instances = page.search_for(target)
+                if text_instances:
+                    found_pages.append(page_idx)
+                    for inst in text_instances:
+                        shape = page.new_shape()
+                        shape.draw_rect(inst)
+                        shape.finish(color=(1, 0, 0), width=2)
+                        shape.commit(overlay=True)
+
+        valid_pages = [p for p in found_pages if p < len(doc)]
+        display_page_idx = valid_pages[0] if valid_pages else 0
+
+        timestamp = int(datetime.now().timestamp())
+        img_filename = f"evidence_{doc_id}_{timestamp}.png"
+        img_path = f"static/{img_filename}"
+
+        pix = doc[display_page_idx].get_pixmap(dpi=150)
+        pix.save(img_path)
+        doc.close()
     
     return {
         "data": extracted_data,
@@ -97,30 +283,251 @@ def local_extraction(doc_id: str):
         "page_num": display_page_idx + 1
     }
 
+def parse_gps(gps_raw):
+    if ',' in gps_raw:
+        return gps_raw.split(',')[0].strip(), gps_raw.split(',')[1].strip()
+    parts = gps_raw.split()
+    return parts[0], parts[1]
+
 def local_verification(doc_id: str):
     """Replaces @app.post('/verification/{doc_id}')"""
+    return _coalesced(("verification", doc_id), _verify_document, doc_id)
+
+def _verify_document(doc_id):
     try:
         record = audit_vault.get(doc_id)
         data = record.get("extracted_data")
         
-        gps_raw = data['gps']['value']
-        if ',' in gps_raw:
-            lat, lon = gps_raw.split(',')[0].strip(), gps_raw.split(',')[1].strip()
-        else:
-            parts = gps_raw.split()
-            lat, lon = parts[0], parts[1]
+        lat, lon = parse_gps(data['gps']['value'])
 
         target_ndvi = float(data['ndvi']['value'])
         result = verifier.verify_zonal_truth(lat, lon, target_ndvi)
         
-        audit_vault[doc_id]["sat_res"] = result
+        audit_vault.update(doc_id, sat_res=result)
         return result
     except Exception as e:
         return {"status": "ERROR", "reason": str(e)}
 
-def local_audit(doc_id, target, actual, breach_ratio, ratchet_bps):
+def local_drill_down(doc_id: str, polygon=None, bounds=None, scale_m=10):
+    """Inspect part of a verified site at another zoom, served from its NDVI tile pyramid."""
+    record = audit_vault.get(doc_id) or {}
+    data = record.get("extracted_data")
+    if not data:
+        return {"status": "ERROR", "reason": "Run extraction first"}
+    lat, lon = parse_gps(data['gps']['value'])
+    return verifier.drill_down(lat, lon, polygon=polygon, bounds=bounds, scale_m=scale_m)
+
+def local_audit(doc_id, target, actual, breach_ratio, ratchet_bps, patch_count=None):
     """Replaces @app.post('/audit')"""
     # result contains 'report_path' and 'Digital_seal'
-    return ledger.calculate_final_verdict(
-        doc_id, target, actual, breach_ratio, ratchet_bps
-    )
\ No newline at end of file
+    return _coalesced(
+        ("audit", doc_id, target, actual, breach_ratio, ratchet_bps),
+        ledger.calculate_final_verdict, doc_id, target, actual, breach_ratio, ratchet_bps, patch_count
+    )
+
+def ledger_breach_ratio(sat):
+    """Breach ratio fed to the ledger: only patches above the minimum size when available."""
+    pct = sat.get('significant_breach_percentage', sat.get('breach_area_percentage', "0"))
+    return float(str(pct).replace('%', '')) / 100
+
+def local_ledger(doc_id: str):
+    """Phase 4 straight from the vault (same inputs the dashboard passes to local_audit)."""
+    record = audit_vault.get(doc_id) or {}
+    ext = record.get("extracted_data")
+    sat = record.get("sat_res") or {}
+    if not ext or sat.get("status") != "SUCCESS":
+        return {"status": "ERROR", "reason": sat.get("reason") or sat.get("message") or "Verification missing"}
+    return local_audit(
+        doc_id=doc_id,
+        target=float(ext['ndvi']['value']),
+        actual=float(sat.get('actual_ndvi', 0)),
+        breach_ratio=ledger_breach_ratio(sat),
+        ratchet_bps=float(ext['margin']['value']),
+        patch_count=sat.get('significant_patch_count')
+    )
+
+def verify_documents(doc_ids, workers=4):
+    """Phase 3 for many extracted documents at once.
+
+    Sites are grouped by overlapping ROI, so syndicated/refinanced loans on
+    the same estate share one imagery stack and one NDVI grid fetch.
+    """
+    sites = []
+    for doc_id in doc_ids:
+        data = (audit_vault.get(doc_id) or {}).get("extracted_data")
+        if not data:
+            continue
+        try:
+            lat, lon = parse_gps(data['gps']['value'])
+            sites.append({"site_id": doc_id, "lat": lat, "lon": lon, "target_ndvi": float(data['ndvi']['value'])})
+        except Exception as e:
+            audit_vault.update(doc_id, sat_res={"status": "ERROR", "reason": str(e)})
+
+    verified = verifier.verify_portfolio(sites, workers=workers)
+    for doc_id, result in verified["results"].items():
+        audit_vault.update(doc_id, sat_res=result)
+    return verified["dedup"]
+
+def run_portfolio(files, mask_workers=1, extract_workers=4, verify_workers=4, audit_workers=1, queue_size=4,
+                  verify_batch=8, verify_wait_s=10.0):
+    """Audits many contracts at once.
+
+    `files` is a list of (file_bytes, filename). Masking, Gemini extraction,
+    verification and the ledger overlap across documents in one pipeline.
+    Verification takes extracted documents in micro-batches (up to
+    verify_batch, waiting at most verify_wait_s for more), so overlapping
+    sites within a batch share imagery while Earth Engine waits overlap with
+    masking and extraction of later documents.
+
+    Trade-off: sites only share imagery within a batch. On 16 contracts
+    (real masking, 3 s per fake Earth Engine group) distinct sites finished
+    in 56 s vs 65 s with one verification pass after intake; 16 identical
+    sites took the same time but 4 imagery stacks instead of 1. The wait
+    costs little while intake is the bottleneck (the last batch closes as
+    soon as intake ends), so raise verify_wait_s for more sharing.
+    """
+    dedup = {"sites": 0, "imagery_stacks": 0, "shared_groups": 0}
+    dedup_lock = threading.Lock()
+    doc_ids = []
+
+    def mask(file):
+        doc_id = local_masking(*file, progressive=False)["doc_id"]
+        doc_ids.append(doc_id)
+        return doc_id
+
+    def verify_batch_of(doc_ids):
+        batch = verify_documents(doc_ids, workers=verify_workers)
+        with dedup_lock:
+            for key in dedup:
+                dedup[key] += batch[key]
+        # Verification errors are reported against that stage, not as a missing input to the ledger
+        return [_verification_outcome(doc_id) for doc_id in doc_ids]
+
+    pipeline = AuditPipeline([
+        Stage("masking", mask, mask_workers),
+        Stage("extraction", lambda doc_id: check_result(local_extraction(doc_id)) and doc_id, extract_workers),
+        # One batch at a time: while it waits on Earth Engine the queue fills
+        # up, so the next batch (and its imagery sharing) grows with the backlog
+        Stage("verification", verify_batch_of, 1, batch_size=verify_batch, batch_wait_s=verify_wait_s),
+        Stage("audit", local_ledger, audit_workers),
+    ], queue_size=queue_size)
+    results = pipeline.run_sync(files)
+
+    stats = pipeline.stats()
+    dedup["dedup_ratio"] = round(1 - dedup["imagery_stacks"] / dedup["sites"], 4) if dedup["sites"] else 0.0
+    dedup["batches"] = stats["stages"]["verification"]["batches"]
+    dedup["failed"] = stats["stages"]["verification"]["failed"]
+    return {
+        "results": results,
+        "pipeline": stats,
+        "verification": dedup,
+        "page_reuse": portfolio_page_reuse(doc_ids),
+    }
+
+def _verification_outcome(doc_id):
+    sat = (audit_vault.get(doc_id) or {}).get("sat_res") or {}
+    if sat.get("status") == "ERROR":
+        return {"status": "ERROR", "reason": sat.get("reason") or sat.get("message")}
+    return doc_id
+
+
+def portfolio_query(aggregates, group_by=None, where=None, start=None, end=None):
+    """Filter / group-by / aggregate over the audit history, e.g. quarterly breach uplift."""
+    return audit_store.query(aggregates, group_by=group_by, where=where, start=start, end=end)
+
+def portfolio_version():
+    """Changes whenever an audit is recorded (cache key for dashboard summaries)."""
+    return audit_store.version
+
+def portfolio_page(page, page_size=50, where=None):
+    """One page of past audits for the portfolio view (never loads the full history)."""
+    return {
+        "rows": audit_store.page(page, page_size=page_size, where=where),
+        "total": audit_store.count(where=where),
+    }
+
+
+# --- STRESS TEST BLOCK (real bridge entry points, fake Gemini / Earth Engine) ---
+if __name__ == "__main__":
+    import random
+    import shutil
+    import tempfile
+    import time
+
+    class FakeBrain:
+        def run(self, pdf_path, pages=None):
+            time.sleep(random.uniform(0.05, 0.15))  # Gemini round-trip
+            return {"gps": {"value": "61.62501, 24.32816"}, "ndvi": {"value": "0.75"}, "margin": {"value": "5.0"}}
+
+    class FakeVerifier:
+        def verify_zonal_truth(self, lat, lon, target_ndvi):
+            time.sleep(random.uniform(0.05, 0.15))  # Earth Engine round-trip
+            return {"status": "SUCCESS", "actual_ndvi": 0.61, "breach_area_percentage": "4.2%",
+                    "significant_breach_percentage": "3.1%", "significant_patch_count": 2}
+
+    tmp_root = tempfile.mkdtemp(prefix="bridge_stress_")
+    brain, verifier = FakeBrain(), FakeVerifier()
+    ledger = TrustLedger(base_margin_bps=150, history=AuditHistoryStore(os.path.join(tmp_root, "store")))
+    ledger.reports_dir = tmp_root
+
+    with open("data/lma_150_dataset/LMA_Success_1.pdf", "rb") as f:
+        pdf_bytes = f.read()
+    doc_id = hashlib.md5(pdf_bytes).hexdigest()
+    failures = []
+
+    def analyst(name):
+        # Full Phase 1-4 walk, exactly as the dashboard drives it
+        try:
+            masked = local_masking(pdf_bytes, "contract.pdf")
+            ext = local_extraction(masked["doc_id"])
+            sat = local_verification(masked["doc_id"])
+            verdict = local_ledger(masked["doc_id"])
+        except Exception as e:
+            failures.append((name, "crash", repr(e)))
+            return
+        for phase, res in (("extraction", ext), ("verification", sat), ("audit", verdict)):
+            if not isinstance(res, dict) or res.get("status") == "ERROR":
+                failures.append((name, phase, res))
+
+    def re_uploader(stop):
+        # Another analyst keeps re-uploading the same contract mid-audit
+        while not stop.is_set():
+            local_masking(pdf_bytes, "contract_copy.pdf", progressive=random.random() < 0.5)
+            time.sleep(random.uniform(0.0, 0.02))
+
+    t0 = time.perf_counter()
+    stop = threading.Event()
+    uploaders = [threading.Thread(target=re_uploader, args=(stop,)) for _ in range(4)]
+    analysts = [threading.Thread(target=analyst, args=(f"analyst_{i}",)) for i in range(12)]
+    for t in uploaders + analysts:
+        t.start()
+    for t in analysts:
+        t.join()
+    stop.set()
+    for t in uploaders:
+        t.join()
+
+    record = audit_vault.get(doc_id)
+    assert not failures, failures[:3]
+    assert record.get("extracted_data") and record.get("sat_res") and record.get("path"), sorted(record)
+    assert inflight.stats()["in_flight"] == 0 and len(doc_locks) == 0
+    print(f"12 analysts + 4 re-uploaders on one contract in {time.perf_counter() - t0:.2f}s: "
+          f"no phase lost its inputs; single-flight {inflight.stats()}")
+
+    # A re-upload never queues behind another session's Earth Engine call
+    slow_sat = threading.Event()
+    verifier.verify_zonal_truth = lambda *args: slow_sat.wait(5) and {"status": "SUCCESS"}
+    audit_vault.update(doc_id, sat_res=None)
+    verifying = threading.Thread(target=local_verification, args=(doc_id,))
+    verifying.start()
+    t0 = time.perf_counter()
+    local_masking(pdf_bytes, "contract_copy.pdf")
+    waited = time.perf_counter() - t0
+    slow_sat.set()
+    verifying.join()
+    assert waited < 1.0, f"masking waited {waited:.2f}s behind verification"
+    print(f"Re-upload answered in {waited * 1000:.0f} ms while verification was in flight")
+
+    masking_pool.shutdown(wait=True)
+    shutil.rmtree(tmp_root)
+    print("All bridge stress checks passed.")
@@ -0,0 +1,196 @@
+import threading
+from contextlib import contextmanager
+
+# PyMuPDF (fitz) is not thread-safe: every fitz call in the process (masking
+# workers, background masking, extraction, evidence rendering) holds this
+# lock. Long jobs take it per page so they interleave with other sessions.
+PDF_LOCK = threading.RLock()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is in flight wait and receive the same result, or the
+    same exception. Once it finishes the key is released, so a later call
+    runs fresh.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Returns (result, shared) where shared is True for callers that piggy-backed."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {"executions": self.executions, "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+class KeyedLocks:
+    """One re-entrant lock per key (e.g. doc_id), dropped again when nobody holds or waits for it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}  # key -> [RLock, users]
+
+    @contextmanager
+    def __call__(self, key):
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.RLock(), 0])
+            entry[1] += 1
+        entry[0].acquire()
+        try:
+            yield
+        finally:
+            entry[0].release()
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._locks)
+
+
+class AuditVault:
+    """In-memory record store shared by every Streamlit session; each update is atomic."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._records = {}
+
+    def get(self, doc_id):
+        """Shallow copy of the record, so readers never see another session's half-update."""
+        with self._lock:
+            record = self._records.get(doc_id)
+            return dict(record) if record is not None else None
+
+    def put(self, doc_id, record):
+        with self._lock:
+            self._records[doc_id] = dict(record)
+
+    def update(self, doc_id, **fields):
+        with self._lock:
+            self._records.setdefault(doc_id, {}).update(fields)
+
+    def __contains__(self, doc_id):
+        with self._lock:
+            return doc_id in self._records
+
+
+# --- STRESS TEST BLOCK ---
+if __name__ == "__main__":
+    import random
+    import time
+    from collections import Counter
+    from concurrent.futures import ThreadPoolExecutor
+
+    flight = SingleFlight()
+    locks = KeyedLocks()
+    runs = Counter()
+    runs_lock = threading.Lock()
+    active = Counter()
+    overlap_errors = []
+
+    vault = AuditVault()
+
+    def run_phase(phase, doc_id):
+        # Per-doc_id lock: two phases of the same document never interleave
+        with locks(doc_id):
+            with runs_lock:
+                runs[(phase, doc_id)] += 1
+                active[doc_id] += 1
+                if active[doc_id] > 1:
+                    overlap_errors.append(doc_id)
+            time.sleep(random.uniform(0.02, 0.05))  # stands in for Gemini + Earth Engine
+            vault.update(doc_id, **{phase: f"{phase}-{doc_id}"})
+            with runs_lock:
+                active[doc_id] -= 1
+            return vault.get(doc_id)[phase]
+
+    def submit(request):
+        phase, doc_id = request
+        result, shared = flight.do((phase, doc_id), run_phase, phase, doc_id)
+        assert result == f"{phase}-{doc_id}"
+        return shared
+
+    doc_ids = [f"doc_{i}" for i in range(20)]
+    phases = ["extraction", "verification", "audit"]
+    requests = [(random.choice(phases), random.choice(doc_ids)) for _ in range(2000)]
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        shared_flags = list(pool.map(submit, requests))
+    elapsed = time.perf_counter() - t0
+
+    stats = flight.stats()
+    assert not overlap_errors, overlap_errors
+    assert stats["executions"] == sum(runs.values())
+    assert stats["executions"] + stats["coalesced"] == len(requests)
+    assert stats["in_flight"] == 0 and len(locks) == 0
+    assert all(set(vault.get(d)) <= set(phases) for d in doc_ids if d in vault)
+    print(f"{len(requests)} requests ({len(phases)} phases x {len(doc_ids)} doc_ids) from 64 threads in {elapsed:.2f}s")
+    print(f"Pipeline executions: {stats['executions']}, coalesced: {stats['coalesced']} "
+          f"({sum(shared_flags) / len(requests):.0%} of requests shared an in-flight run)")
+
+    # Failures reach every waiter, and the key is released for a clean retry
+    def boom():
+        time.sleep(0.05)
+        raise RuntimeError("backend down")
+
+    errors = []
+
+    def failing():
+        try:
+            flight.do("broken", boom)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=failing) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(errors) == 10 and flight.stats()["in_flight"] == 0
+    print("All single-flight stress checks passed.")
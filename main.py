@@ -2,7 +2,8 @@ import streamlit as st
 import os
 import pandas as pd
 # --- CHANGE 1: Import functions from bridge instead of requests ---
-from bridge import local_masking, local_extraction, local_verification, local_audit
+from bridge import local_masking, local_extraction, local_verification, local_audit, ledger_breach_ratio
+from bridge import portfolio_page, portfolio_query, portfolio_version
 
 st.set_page_config(layout="wide", page_title="LMA-Sentinel")
 col_left, col_right = st.columns([0.4, 0.6])
@@ -75,8 +76,9 @@ with col_left:
                     doc_id=st.session_state['doc_id'],
                     target=float(ext['ndvi']['value']), 
                     actual=float(sat.get('actual_ndvi', 0)),
-                    breach_ratio=float(str(sat.get('breach_area_percentage', "0")).replace('%','')) / 100,
-                    ratchet_bps=float(ext['margin']['value'])
+                    breach_ratio=ledger_breach_ratio(sat),
+                    ratchet_bps=float(ext['margin']['value']),
+                    patch_count=sat.get('significant_patch_count')
                 )
                 st.session_state['ledger_data'] = res
                 st.session_state['step'] = 4
@@ -121,6 +123,13 @@ with col_right:
                 sat.get('breach_area_percentage'),
                 "❌ NON-COMPLIANT" if sat.get('is_breach') else "✅ COMPLIANT"
             ]
+            if "patch_count" in sat:
+                metrics += ["Breach Patches", "Largest Patch", "Significant Breach %"]
+                values += [
+                    f"{sat.get('patch_count')} ({sat.get('significant_patch_count')} significant)",
+                    f"{sat.get('largest_patch_area_m2'):,.0f} m²",
+                    sat.get('significant_breach_percentage')
+                ]
             st.table({"Metric": metrics, "Value": values})
             st.info(f"**Planetary Analysis:** {sat.get('analysis')}")
             
@@ -172,4 +181,38 @@ with col_right:
         
         if st.button("New Audit", type="primary"):
             st.session_state.clear()
-            st.rerun()
\ No newline at end of file
+            st.rerun()
+
+# --- PORTFOLIO HISTORY (columnar audit store, paged) ---
+# Cached per filter until a new audit lands, so reruns don't rescan the history
+@st.cache_data(show_spinner=False, max_entries=32)
+def history_summary(statuses, version):
+    where = {"status": list(statuses)} if statuses else None
+    return portfolio_query(
+        {"adjustment_bps": "sum", "revenue_impact_usd": "sum", "breach_ratio": "mean", "doc_id": "count"},
+        group_by="status", where=where
+    )
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def history_rows(statuses, page_idx, page_size, version):
+    where = {"status": list(statuses)} if statuses else None
+    return portfolio_page(page_idx, page_size=page_size, where=where)["rows"]
+
+st.divider()
+with st.expander("📚 Portfolio Audit History"):
+    status_filter = tuple(st.multiselect("Status", ["COMPLIANT", "BREACH", "Double BREACH", "DECLASSIFIED"]))
+    version = portfolio_version()
+
+    summary = history_summary(status_filter, version)
+    if summary:
+        st.dataframe(pd.DataFrame(summary), use_container_width=True, hide_index=True)
+
+    page_size = 50
+    total = sum(row["doc_id_count"] for row in summary)
+    total_pages = max(1, -(-total // page_size))
+    page_no = st.number_input(f"Page (of {total_pages})", min_value=1, max_value=total_pages, value=1)
+    rows = history_rows(status_filter, int(page_no) - 1, page_size, version)
+    if rows:
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    else:
+        st.caption("No audits recorded yet.")
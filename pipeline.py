@@ -0,0 +1,259 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Marks the end of the stream on a stage queue
+_DONE = object()
+
+
+class StageError(Exception):
+    """A stage call that reported {"status": "ERROR", ...} instead of raising."""
+
+
+def check_result(result):
+    """Raises StageError for an ERROR status dict (the bridge's failure convention), else returns it."""
+    if isinstance(result, dict) and result.get("status") == "ERROR":
+        raise StageError(result.get("reason") or result.get("message") or "stage reported an error")
+    return result
+
+
+class _Failed:
+    def __init__(self, stage, error):
+        self.stage = stage
+        self.error = error
+
+    def as_result(self):
+        return {"status": "ERROR", "stage": self.stage, "reason": str(self.error)}
+
+
+class Stage:
+    """One step of the audit pipeline: a blocking function run by `concurrency` workers.
+
+    With batch_size > 1 each worker takes up to batch_size items (waiting at
+    most batch_wait_s for more to arrive) and fn gets a list of payloads and
+    returns one result per payload, in order.
+    """
+
+    def __init__(self, name, fn, concurrency=1, batch_size=1, batch_wait_s=0.0):
+        self.name = name
+        self.fn = fn
+        self.concurrency = max(1, int(concurrency))
+        self.batch_size = max(1, int(batch_size))
+        self.batch_wait_s = batch_wait_s
+        self.processed = 0
+        self.failed = 0
+        self.batches = 0
+        self.busy_seconds = 0.0
+
+
+class AuditPipeline:
+    """
+    Streaming pipeline: every stage is a worker group, stages are linked by
+    bounded queues. A full queue blocks the stage feeding it (backpressure),
+    so document N+1 can be masked while document N waits on Gemini and
+    document N-1 waits on Earth Engine, without piling up work in memory.
+
+    Stage functions are the existing blocking calls; each stage gets its own
+    thread pool sized to its concurrency, so a slow network stage never
+    starves the CPU stage of threads.
+    """
+
+    def __init__(self, stages, queue_size=4):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.elapsed = 0.0
+
+    async def run(self, items):
+        """Pushes items through all stages; results come back in input order.
+
+        A failing item does not stop the run: its result becomes
+        {"status": "ERROR", "stage": ..., "reason": ...} and later stages skip it.
+        A stage fails an item by raising or by returning an ERROR status dict.
+        """
+        started = time.perf_counter()
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = [None] * len(items)
+        pools = [ThreadPoolExecutor(max_workers=s.concurrency, thread_name_prefix=s.name)
+                 for s in self.stages]
+
+        async def take_batch(idx, jobs):
+            """Adds queued jobs to `jobs` up to the stage's batch size; True once the stream ended."""
+            stage, queue = self.stages[idx], queues[idx]
+            deadline = time.perf_counter() + stage.batch_wait_s
+            while len(jobs) < stage.batch_size:
+                try:
+                    job = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        return False
+                    try:
+                        job = await asyncio.wait_for(queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        return False
+                if job is _DONE:
+                    return True
+                jobs.append(job)
+            return False
+
+        async def call(idx, payloads):
+            """Stage results for payloads, with an exception in place of each failed call."""
+            stage, pool = self.stages[idx], pools[idx]
+            loop = asyncio.get_running_loop()
+            try:
+                if stage.batch_size == 1:
+                    return [await loop.run_in_executor(pool, stage.fn, payloads[0])]
+                outputs = list(await loop.run_in_executor(pool, stage.fn, payloads))
+                if len(outputs) != len(payloads):
+                    raise ValueError(f"{stage.name} returned {len(outputs)} results for {len(payloads)} items")
+                return outputs
+            except Exception as e:
+                return [e] * len(payloads)
+
+        async def worker(idx):
+            stage = self.stages[idx]
+            while True:
+                job = await queues[idx].get()
+                if job is _DONE:
+                    return
+                jobs, ended = [job], False
+                if stage.batch_size > 1:
+                    ended = await take_batch(idx, jobs)
+
+                live = [i for i, (_, payload) in enumerate(jobs) if not isinstance(payload, _Failed)]
+                if live:
+                    t0 = time.perf_counter()
+                    outputs = await call(idx, [jobs[i][1] for i in live])
+                    stage.busy_seconds += time.perf_counter() - t0
+                    stage.batches += 1
+                    for i, output in zip(live, outputs):
+                        try:
+                            if isinstance(output, Exception):
+                                raise output
+                            jobs[i] = (jobs[i][0], check_result(output))
+                            stage.processed += 1
+                        except Exception as e:
+                            stage.failed += 1
+                            jobs[i] = (jobs[i][0], _Failed(stage.name, e))
+
+                for pos, payload in jobs:
+                    if idx + 1 < len(self.stages):
+                        await queues[idx + 1].put((pos, payload))
+                    else:
+                        results[pos] = payload.as_result() if isinstance(payload, _Failed) else payload
+                if ended:
+                    return
+
+        async def stage_group(idx):
+            await asyncio.gather(*(worker(idx) for _ in range(self.stages[idx].concurrency)))
+            # Every worker of this stage is done: close the next stage's queue
+            if idx + 1 < len(self.stages):
+                for _ in range(self.stages[idx + 1].concurrency):
+                    await queues[idx + 1].put(_DONE)
+
+        async def feed():
+            for pos, item in enumerate(items):
+                await queues[0].put((pos, item))
+            for _ in range(self.stages[0].concurrency):
+                await queues[0].put(_DONE)
+
+        try:
+            await asyncio.gather(feed(), *(stage_group(i) for i in range(len(self.stages))))
+        finally:
+            for pool in pools:
+                pool.shutdown(wait=False)
+        self.elapsed = time.perf_counter() - started
+        return results
+
+    def run_sync(self, items):
+        return asyncio.run(self.run(items))
+
+    def stats(self):
+        return {
+            "elapsed_s": round(self.elapsed, 3),
+            "stages": {
+                s.name: {
+                    "concurrency": s.concurrency,
+                    "processed": s.processed,
+                    "failed": s.failed,
+                    "batches": s.batches,
+                    "busy_s": round(s.busy_seconds, 3),
+                }
+                for s in self.stages
+            },
+        }
+
+
+def run_sequential(stages, items):
+    """Baseline: every document runs every stage before the next one starts."""
+    results = []
+    for item in items:
+        payload = item
+        for stage in stages:
+            payload = stage.fn([payload])[0] if stage.batch_size > 1 else stage.fn(payload)
+        results.append(payload)
+    return results
+
+
+# --- BENCHMARK BLOCK (latency-injecting fakes, no network needed) ---
+if __name__ == "__main__":
+    def fake_stage(name, seconds):
+        def fn(payload):
+            time.sleep(seconds)
+            return payload + [name]
+        return fn
+
+    latencies = {"masking": 0.05, "extraction": 0.40, "verification": 0.60, "audit": 0.02}
+    docs = [[f"doc_{i}"] for i in range(12)]
+
+    def build(concurrency):
+        return [Stage(name, fake_stage(name, secs), concurrency.get(name, 1))
+                for name, secs in latencies.items()]
+
+    t0 = time.perf_counter()
+    baseline = run_sequential(build({}), docs)
+    sequential_s = time.perf_counter() - t0
+
+    pipe = AuditPipeline(build({"masking": 1, "extraction": 4, "verification": 6, "audit": 1}))
+    piped = pipe.run_sync(docs)
+    assert piped == baseline
+
+    print(f"Sequential : {sequential_s:.2f}s ({len(docs) / sequential_s:.2f} docs/s)")
+    print(f"Pipelined  : {pipe.elapsed:.2f}s ({len(docs) / pipe.elapsed:.2f} docs/s)")
+    print(f"Speed-up   : {sequential_s / pipe.elapsed:.1f}x")
+    print(pipe.stats())
+
+    # An ERROR status dict fails the item at that stage, with that stage's reason
+    def flaky_extraction(payload):
+        if payload[0] == "doc_3":
+            return {"status": "ERROR", "reason": "Gemini returned no fields"}
+        return payload + ["extraction"]
+
+    pipe = AuditPipeline([Stage("masking", fake_stage("masking", 0.0)),
+                          Stage("extraction", flaky_extraction, 2),
+                          Stage("verification", fake_stage("verification", 0.0), 2)])
+    results = pipe.run_sync(docs)
+    assert results[3] == {"status": "ERROR", "stage": "extraction", "reason": "Gemini returned no fields"}
+    assert pipe.stats()["stages"]["extraction"]["failed"] == 1
+    assert pipe.stats()["stages"]["verification"]["processed"] == len(docs) - 1
+    print("Stage errors are reported against the failing stage.")
+
+    # A batched stage gets lists of payloads that arrived together, while
+    # earlier stages keep streaming; one bad item in a batch fails only itself
+    seen = []
+
+    def batch_verification(payloads):
+        time.sleep(latencies["verification"])  # one round-trip for the whole batch
+        seen.append(len(payloads))
+        return [{"status": "ERROR", "reason": "No imagery"} if p[0] == "doc_5" else p + ["verification"]
+                for p in payloads]
+
+    pipe = AuditPipeline([Stage("masking", fake_stage("masking", 0.05)),
+                          Stage("extraction", fake_stage("extraction", 0.40), 4),
+                          Stage("verification", batch_verification, 2, batch_size=4, batch_wait_s=0.2),
+                          Stage("audit", fake_stage("audit", 0.02))])
+    results = pipe.run_sync(docs)
+    assert results[5] == {"status": "ERROR", "stage": "verification", "reason": "No imagery"}
+    assert [r for i, r in enumerate(results) if i != 5] == [b for i, b in enumerate(baseline) if i != 5]
+    assert sum(seen) == len(docs) and max(seen) <= 4
+    print(f"Micro-batched verification: {len(docs)} docs in {len(seen)} batches {seen}, {pipe.elapsed:.2f}s")
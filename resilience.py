@@ -0,0 +1,348 @@
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class DeadlineExceeded(TimeoutError):
+    """An external call did not answer within its deadline."""
+
+
+class CircuitOpenError(RuntimeError):
+    """The backend has been failing; calls fail fast until it cools down."""
+
+
+# Earth Engine reports throttling and server-side timeouts as plain EEException messages
+_TRANSIENT_MESSAGES = re.compile(
+    r"too many (concurrent|requests)|rate limit|quota exceeded|computation timed out"
+    r"|deadline exceeded|service unavailable|internal error|try again",
+    re.IGNORECASE,
+)
+
+
+def _http_status(error):
+    """HTTP status carried by an SDK error (google-genai, googleapiclient, requests), if any."""
+    for holder in (error, getattr(error, "response", None), getattr(error, "resp", None)):
+        for attr in ("code", "status_code", "status"):
+            value = getattr(holder, attr, None) if holder is not None else None
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+    return None
+
+
+def default_is_transient(error):
+    """Only failures a retry can fix: timeouts, dropped connections, 429/5xx, EE throttling."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = _http_status(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    # Anything else (bad request, bad geometry, parse errors) fails the same way every time
+    return bool(_TRANSIENT_MESSAGES.search(str(error)))
+
+
+class CallGuard:
+    """
+    Shared wrapper for blocking calls to external backends (Gemini, Earth Engine).
+
+    - deadline_s: each attempt is abandoned after this many seconds
+    - max_retries: transient failures (is_transient) are retried with full-jitter
+      exponential backoff; anything else is raised straight away
+    - hedge_after_s: seconds (or "p95" of recent latencies) after which a duplicate
+      request is sent; the first answer wins
+    - failure_threshold / reset_after_s: circuit breaker that fails fast once a
+      backend keeps failing, then lets a single trial call through after cooling down.
+      It counts logical calls that ended in a transient failure (not attempts);
+      a deterministic error means the backend answered and never trips it
+    - retry_deadlines: False for paid backends (Gemini): the abandoned attempt keeps
+      running, so a retry after a deadline overrun pays for the same call twice.
+      The overrun still counts as a transient failure for the breaker
+    """
+
+    def __init__(self, name, deadline_s=30.0, max_retries=3, backoff_base_s=0.5, backoff_max_s=8.0,
+                 hedge_after_s=None, hedge_min_samples=20, failure_threshold=5, reset_after_s=30.0,
+                 is_transient=default_is_transient, retry_deadlines=True, max_workers=16):
+        self.name = name
+        self.deadline_s = deadline_s
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.hedge_after_s = hedge_after_s
+        self.hedge_min_samples = hedge_min_samples
+        self.failure_threshold = failure_threshold
+        self.reset_after_s = reset_after_s
+        self.is_transient = is_transient
+        self.retry_deadlines = retry_deadlines
+
+        # Abandoned (timed-out) attempts keep running here, never in the caller's thread
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"guard-{name}")
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=200)
+
+        # Circuit breaker state
+        self._state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+        self._metrics = {
+            "calls": 0, "successes": 0, "failures": 0, "retries": 0, "timeouts": 0,
+            "hedges_sent": 0, "hedges_won": 0, "breaker_opened": 0, "fast_failures": 0,
+        }
+
+    # --- PUBLIC ---
+    def call(self, fn, *args, **kwargs):
+        self._count("calls")
+        self._before_call()
+
+        attempt = 0
+        while True:
+            try:
+                result = self._attempt(fn, args, kwargs)
+            except Exception as e:
+                transient = self.is_transient(e)
+                retryable = transient and (self.retry_deadlines or not isinstance(e, DeadlineExceeded))
+                if attempt >= self.max_retries or not retryable or self._state == "open":
+                    if transient:
+                        self._on_failure()
+                    else:
+                        self._on_success()  # the backend answered; the request itself was bad
+                    self._count("failures")
+                    raise
+                attempt += 1
+                self._count("retries")
+                time.sleep(self._backoff(attempt))
+                continue
+            self._on_success()
+            self._count("successes")
+            return result
+
+    def metrics(self):
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot["breaker_state"] = self._state
+            snapshot["hedge_delay_s"] = self._hedge_delay()
+            snapshot["p95_latency_s"] = self._percentile(0.95)
+        return snapshot
+
+    # --- ATTEMPTS, HEDGING & DEADLINES ---
+    def _attempt(self, fn, args, kwargs):
+        started = time.monotonic()
+        deadline = started + self.deadline_s
+        pending = {self._pool.submit(fn, *args, **kwargs)}
+        primary = next(iter(pending))
+
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is not None and hedge_delay < self.deadline_s:
+            done, pending = wait(pending, timeout=hedge_delay)
+            if not done:
+                pending.add(self._pool.submit(fn, *args, **kwargs))
+                self._count("hedges_sent")
+        else:
+            done = set()
+
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is not primary:
+                        self._count("hedges_won")
+                    self._record_latency(time.monotonic() - started)
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+
+        for future in pending:
+            future.cancel()
+        self._count("timeouts")
+        raise DeadlineExceeded(f"{self.name} call exceeded its {self.deadline_s}s deadline")
+
+    def _hedge_delay(self):
+        if self.hedge_after_s == "p95":
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            return self._percentile(0.95)
+        return self.hedge_after_s
+
+    def _percentile(self, q):
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def _record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def _backoff(self, attempt):
+        # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt)))
+
+    # --- CIRCUIT BREAKER ---
+    def _before_call(self):
+        with self._lock:
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.reset_after_s:
+                    self._metrics["fast_failures"] += 1
+                    raise CircuitOpenError(f"{self.name} backend unavailable (circuit open)")
+                self._state = "half_open"
+                self._trial_in_flight = False
+            if self._state == "half_open":
+                if self._trial_in_flight:
+                    self._metrics["fast_failures"] += 1
+                    raise CircuitOpenError(f"{self.name} backend recovering (trial call in flight)")
+                self._trial_in_flight = True
+
+    def _on_success(self):
+        with self._lock:
+            self._state = "closed"
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def _on_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._metrics["breaker_opened"] += 1
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def _count(self, key):
+        with self._lock:
+            self._metrics[key] += 1
+
+
+# --- TEST BLOCK (local fakes injecting delays and errors) ---
+if __name__ == "__main__":
+    class FlakyBackend:
+        def __init__(self, fail_first=0, delay_s=0.0, slow_every=0, slow_delay_s=0.0):
+            self.calls = 0
+            self.fail_first = fail_first
+            self.delay_s = delay_s
+            self.slow_every = slow_every
+            self.slow_delay_s = slow_delay_s
+            self._lock = threading.Lock()
+
+        def __call__(self, value):
+            with self._lock:
+                self.calls += 1
+                n = self.calls
+            if n <= self.fail_first:
+                raise ConnectionError(f"transient failure #{n}")
+            slow = self.slow_every and n % self.slow_every == 0
+            time.sleep(self.slow_delay_s if slow else self.delay_s)
+            return value
+
+    # 1. Retries with backoff recover from transient errors
+    guard = CallGuard("retry", deadline_s=1, max_retries=3, backoff_base_s=0.01)
+    assert guard.call(FlakyBackend(fail_first=2), "ok") == "ok"
+    assert guard.metrics()["retries"] == 2
+
+    # 2. Deadlines stop a hung call
+    guard = CallGuard("deadline", deadline_s=0.1, max_retries=0)
+    try:
+        guard.call(FlakyBackend(delay_s=1.0), "late")
+        raise AssertionError("expected DeadlineExceeded")
+    except DeadlineExceeded:
+        pass
+
+    # 3. Hedged requests cut the tail: every 25th call stalls for 1s
+    backend = FlakyBackend(delay_s=0.01, slow_every=25, slow_delay_s=1.0)
+    guard = CallGuard("hedge", deadline_s=2, max_retries=0, hedge_after_s="p95", hedge_min_samples=10)
+    t0 = time.perf_counter()
+    for i in range(100):
+        guard.call(backend, i)
+    hedged_s = time.perf_counter() - t0
+    m = guard.metrics()
+    assert m["hedges_won"] > 0, m
+    print(f"Hedged 100 calls in {hedged_s:.2f}s: {m}")
+
+    # 4. Circuit breaker fails fast while the backend is down, then recovers
+    guard = CallGuard("breaker", deadline_s=1, max_retries=0, failure_threshold=3, reset_after_s=0.2)
+    down = FlakyBackend(fail_first=3)
+    for _ in range(3):
+        try:
+            guard.call(down, "x")
+        except ConnectionError:
+            pass
+    try:
+        guard.call(down, "x")
+        raise AssertionError("expected CircuitOpenError")
+    except CircuitOpenError:
+        pass
+    time.sleep(0.25)
+    assert guard.call(down, "back") == "back"
+    m = guard.metrics()
+    assert m["breaker_state"] == "closed" and m["fast_failures"] == 1, m
+    print(f"Breaker: {m}")
+    print("All call-guard checks passed.")
+
+    # 5. Only transient errors are retried
+    class ApiError(Exception):
+        def __init__(self, code, message):
+            super().__init__(message)
+            self.code = code
+
+    class EEException(Exception):
+        pass
+
+    assert default_is_transient(ConnectionResetError("reset by peer"))
+    assert default_is_transient(DeadlineExceeded("slow"))
+    assert default_is_transient(ApiError(429, "RESOURCE_EXHAUSTED"))
+    assert default_is_transient(ApiError(503, "UNAVAILABLE"))
+    assert not default_is_transient(ApiError(400, "INVALID_ARGUMENT"))
+    assert not default_is_transient(ApiError(403, "PERMISSION_DENIED"))
+    assert default_is_transient(EEException("Computation timed out."))
+    assert default_is_transient(EEException("Too many concurrent aggregations."))
+    assert not default_is_transient(EEException("Image.select: Pattern 'B9' did not match any bands."))
+    assert not default_is_transient(ValueError("could not convert string to float: 'N/A'"))
+
+    # 6. Bad requests never trip the breaker; one exhausted call counts once, not per attempt
+    guard = CallGuard("classify", deadline_s=1, max_retries=3, backoff_base_s=0.001,
+                      failure_threshold=2, reset_after_s=60)
+    bad_calls = []
+
+    def bad_request():
+        bad_calls.append(1)
+        raise EEException("Invalid GeoJSON geometry.")
+
+    for _ in range(5):
+        try:
+            guard.call(bad_request)
+        except EEException:
+            pass
+    assert len(bad_calls) == 5 and guard.metrics()["breaker_state"] == "closed", guard.metrics()
+
+    flaky = FlakyBackend(fail_first=4)
+    try:
+        guard.call(flaky, "x")  # 4 attempts, all transient
+    except ConnectionError:
+        pass
+    m = guard.metrics()
+    assert flaky.calls == 4 and m["breaker_state"] == "closed" and m["breaker_opened"] == 0, m
+    print(f"Classification: {m}")
+
+    # 7. With retry_deadlines=False an overrun is raised at once (the abandoned attempt
+    #    is still running, a retry would pay for it twice) but still counts for the breaker
+    guard = CallGuard("paid", deadline_s=0.05, max_retries=2, backoff_base_s=0.001,
+                      failure_threshold=1, retry_deadlines=False)
+    slow = FlakyBackend(delay_s=0.3)
+    try:
+        guard.call(slow, "x")
+        raise AssertionError("expected DeadlineExceeded")
+    except DeadlineExceeded:
+        pass
+    m = guard.metrics()
+    assert slow.calls == 1 and m["retries"] == 0 and m["breaker_state"] == "open", m
+    print("All transient-classification checks passed.")
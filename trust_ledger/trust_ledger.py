@@ -5,12 +5,16 @@ import os
 
 
 class TrustLedger:
-    def __init__(self, base_margin_bps=150):
+    def __init__(self, base_margin_bps=150, history=None):
         self.base_margin = base_margin_bps 
         self.reports_dir = "reports"
         os.makedirs(self.reports_dir, exist_ok=True)
+        # Optional AuditHistoryStore: every verdict is appended with typed numeric fields
+        self.history = history
 
-    def calculate_final_verdict(self, doc_id, target, actual, breach_ratio, ratchet_bps):
+    def calculate_final_verdict(self, doc_id, target, actual, breach_ratio, ratchet_bps, patch_count=None):
+        # breach_ratio should already exclude patches below the verifier's minimum
+        # patch size; patch_count (when known) is cited in the escalation reason
         # 1. THE GOVERNANCE KILL-SWITCH
         if actual is None:
             status = "DECLASSIFIED"
@@ -23,6 +27,8 @@ class TrustLedger:
             status = "Double BREACH"
             adjustment = ratchet_bps * 2
             reason = f"CRITICAL: {round(breach_ratio*100, 1)}% Physical Degradation Detected"
+            if patch_count is not None:
+                reason += f" in {patch_count} patch(es)"
             display_actual = str(actual)
 
         # 3. STANDARD RATCHET
@@ -53,6 +59,19 @@ class TrustLedger:
             doc_id, target, display_actual, status, impact_str, new_margin,reason, breach_ratio
         )
 
+        if self.history is not None:
+            self.history.append({
+                "doc_id": doc_id,
+                "status": status,
+                "target_ndvi": float(target),
+                "actual_ndvi": float(actual) if actual is not None else None,
+                "breach_ratio": float(breach_ratio),
+                "adjustment_bps": float(adjustment),
+                "final_margin_bps": float(new_margin),
+                "revenue_impact_usd": annual_revenue_change if adjustment >= 0 else -annual_revenue_change,
+                "digital_seal": final_digital_Seal,
+            })
+
         # RETURN AS DICTIONARY (For FastAPI/Streamlit)
         return {
             "loan_ref": doc_id,